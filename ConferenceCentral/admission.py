@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+"""admission.py
+
+Udacity conference server-side Python App Engine queued registration
+
+Conferences in admission mode (Conference.registrationQueued) don't run a
+registration transaction per caller. Registrations are appended to the
+"registration" pull queue, tagged with the conference, and a drain task
+leases them in batches and allocates seats with one transaction per
+conference and chunk of ADMIT_BATCH users. Until then the registration is marked pending in memcache,
+which the registration status endpoint reads.
+
+"""
+
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+
+QUEUE_NAME = 'registration'
+# tasks leased per drain (the lease_tasks maximum) and how long for
+LEASE_BATCH = 1000
+LEASE_SECONDS = 60
+# seconds a drain waits for registrations to accumulate
+DRAIN_DELAY = 2
+# users decided per transaction: a Reservation each plus the seat shards,
+# within the datastore's 500 entity commit limit
+ADMIT_BATCH = 450
+
+MEMCACHE_PENDING_TPL = "REGISTRATION_PENDING:%s:%s"
+PENDING_TIME = 3600 # seconds
+
+
+def _pendingKey(wsck, user_id):
+    return MEMCACHE_PENDING_TPL % (wsck, user_id)
+
+
+def isPending(wsck, user_id):
+    """Return True if the user's registration is waiting in the queue."""
+    return memcache.get(_pendingKey(wsck, user_id)) is not None
+
+
+def clearPending(wsck, user_ids):
+    """Drop the pending markers once registrations have been decided."""
+    memcache.delete_multi([_pendingKey(wsck, user_id) for user_id in user_ids])
+
+
+def enqueue(wsck, user_id):
+    """Queue the user's registration for the conference.
+
+    The task is queued even if the user is already waiting: the drain
+    skips repeated and confirmed users, while the pending marker is only
+    a hint that memcache may have dropped.
+    """
+    memcache.set(_pendingKey(wsck, user_id), 1, time=PENDING_TIME)
+    taskqueue.Queue(QUEUE_NAME).add(
+        taskqueue.Task(payload=user_id, method='PULL', tag=wsck))
+    scheduleDrain()
+
+
+def scheduleDrain():
+    """Schedule at most one drain per DRAIN_DELAY seconds."""
+    bucket = int(time.time() / DRAIN_DELAY)
+    try:
+        taskqueue.add(
+            name='drain-registrations-%d' % bucket,
+            url='/tasks/drain_registrations',
+            countdown=DRAIN_DELAY
+        )
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def lease():
+    """Lease a batch of queued registrations; return the number of tasks
+    leased and (websafeConferenceKey, tasks, user ids) per conference, in
+    queue order and without repeated users.
+    """
+    tasks = taskqueue.Queue(QUEUE_NAME).lease_tasks(LEASE_SECONDS, LEASE_BATCH)
+    batches = {}
+    order = []
+    for task in tasks:
+        wsck = task.tag
+        if wsck not in batches:
+            batches[wsck] = ([], [])
+            order.append(wsck)
+        conf_tasks, user_ids = batches[wsck]
+        conf_tasks.append(task)
+        if task.payload not in user_ids:
+            user_ids.append(task.payload)
+    return len(tasks), [(wsck,) + batches[wsck] for wsck in order]
+
+
+def delete(tasks):
+    """Delete registrations that have been decided from the queue."""
+    taskqueue.Queue(QUEUE_NAME).delete_tasks(tasks)
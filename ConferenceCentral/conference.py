@@ -14,12 +14,20 @@ __author__ = 'wesc+api@google.com (Wesley Chun)'
 
 
 from datetime import datetime
+import csv
+import hashlib
+import json
+import logging
+import time
+from StringIO import StringIO
 
 import endpoints
 from protorpc import messages
 from protorpc import message_types
+from protorpc import protobuf
 from protorpc import remote
 
+from google.appengine.api import datastore_errors
 from google.appengine.api import memcache
 from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
@@ -31,28 +39,40 @@ from models import Profile
 from models import ProfileMiniForm
 from models import ProfileForm
 from models import StringMessage
+from models import Announcement
 from models import BooleanMessage
 from models import Conference
+from models import Reservation
+from models import RegistrationStatus
+from models import RegistrationStatusForm
 from models import ConferenceLink
 from models import ConferenceForm
+from models import ConferenceBatchRequest
 from models import ConferenceForms
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
 from models import Session
 from models import SessionLink
 from models import SessionLinkResponse
+from models import SessionConflictResponse
+from models import SessionConflictListResponse
 from models import SessionResponse
 from models import SessionListResponse
+from models import SessionBatchRequest
 from models import SessionQueryRequest
 from models import SessionType
+from models import UniqueValue
 from models import SessionTypeRequest
 from models import SessionTypeResponse
 from models import SessionTypeListResponse
 from models import TeeShirtSize
+from models import WishlistItem
+from models import normalizeName
 from models import ConferenceSessionWishlistRequest
 from models import Speaker
 from models import SpeakerLink
 from models import SpeakerLinkResponse
+from models import SpeakerLinkListResponse
 from models import SpeakerRequest
 from models import SpeakerResponse
 from models import SpeakerListResponse
@@ -65,20 +85,77 @@ from settings import IOS_CLIENT_ID
 from settings import ANDROID_AUDIENCE
 
 from utils import getUserId
+from utils import overlappingPairs
+from utils import newGeneration
+
+import admission
+import planner
+import predicates
+import propagation
+import schedule
+import seats
+import unique
+from snapshot import absoluteMinutes
+from snapshot import getSnapshot
+from snapshot import refreshSnapshot
+from snapshot import sessionInterval
 
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
 MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
 ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
                     'are nearly sold out: %s')
+ANNOUNCEMENT_ID = "nearly_sold_out"
+# conferences with at most this many seats left are nearly sold out
+NEARLY_SOLD_OUT_SEATS = 5
+
+# per conference [(websafeSpeakerKey, name, numberOfSessions)], ranked
+MEMCACHE_FEATURED_SPEAKERS_TPL = "FEATURED_SPEAKERS:%s"
+FEATURED_SPEAKERS_LIMIT = 5
+# speakers with at least this many sessions in a conference are featured
+FEATURED_SPEAKER_MIN_SESSIONS = 2
+
+# fields holding names that are unique among entities of their kind
+UNIQUE_FIELDS = {
+    'Session': 'name',
+    'SessionType': 'label',
+}
 
-MEMCACHE_FEATURED_SPEAKER_KEY = "FEATURED_SPEAKER"
+# kinds with indexed or computed properties derived on put, written again by
+# the reindex_entities task
+REINDEXED_KINDS = ('Session', 'Speaker')
+
+# queryConferences page size; MAX_PAGE_SIZE is enforced regardless of request
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# queryConferences result cache; entries are keyed by the conference
+# generation, which is bumped whenever a conference is written
+MEMCACHE_CONFERENCE_GENERATION_KEY = "CONFERENCE_GENERATION"
+MEMCACHE_CONFERENCE_QUERY_TPL = "CONFERENCE_QUERY:%s:%s"
+CONFERENCE_QUERY_CACHE_TIME = 300 # seconds
+# time of the last bump; the global query may miss a write for a while
+# after it, so results aren't cached until it has settled
+MEMCACHE_CONFERENCE_WRITTEN_KEY = "CONFERENCE_WRITTEN"
+CONFERENCE_QUERY_SETTLE_TIME = 10 # seconds
+
+# bounds the entities examined for one page when filters run in memory,
+# once the page has a match
+MAX_QUERY_SCAN = 1000
+
+# sessions imported by one sessions:batch call
+MAX_SESSION_BATCH = 1000
+# conferences created by one conferences:batch call
+MAX_CONFERENCE_BATCH = 500
+# entity groups written by one cross-group transaction
+XG_TRANSACTION_GROUPS = 25
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 DEFAULTS = {
     "city": "Default City",
     "maxAttendees": 0,
     "seatsAvailable": 0,
+    "registrationQueued": False,
     "topics": [ "Default", "Topic" ],
 }
 
@@ -108,11 +185,13 @@ SESSION_FIELDS = {
     'END': 'endTime'
 }
 
-STRING = "string"
-INT = "int"
-DATE = "date"
-DATETIME = "datetime"
-TIME = "time"
+SESSION_FIELD_TYPES = {
+    'typeOfSession': predicates.STRING,
+    'date': predicates.DATE,
+    'startTime': predicates.TIME,
+    'duration': predicates.INT,
+    'endTime': predicates.TIME
+}
 
 CONF_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
@@ -131,6 +210,10 @@ CONF_SESS_STORE_REQUEST = endpoints.ResourceContainer(
     SessionResponse,
     websafeConferenceKey=messages.StringField(1))
 
+CONF_SESS_BATCH_REQUEST = endpoints.ResourceContainer(
+    SessionBatchRequest,
+    websafeConferenceKey=messages.StringField(1))
+
 CONF_SESS_SHOW_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeSessionKey=messages.StringField(1))
@@ -146,6 +229,15 @@ CONF_SESS_QUERY_REQ = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1)
     )
 
+CONF_SESS_WINDOW_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    date=messages.StringField(2),       # YYYY-MM-DD
+    startTime=messages.StringField(3),  # HH:MM
+    endTime=messages.StringField(4),    # HH:MM
+    endDate=messages.StringField(5)     # YYYY-MM-DD, defaults to date
+    )
+
 
 SESS_TYPE_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
@@ -168,13 +260,29 @@ CONF_SPEAK_DELETE_REQ = CONF_SPEAK_SHOW_REQ
 
 
 SESS_SPEAK_STORE_REQ = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeSessionKey=messages.StringField(1),
+    websafeSpeakerKey=messages.StringField(2),
+    checkConflicts=messages.BooleanField(3)
+    )
+
+SESS_SPEAK_DELETE_REQ = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeSessionKey=messages.StringField(1),
     websafeSpeakerKey=messages.StringField(2)
     )
 
-SESS_SPEAK_DELETE_REQ = SESS_SPEAK_STORE_REQ
 
+CONF_FEATURED_SPEAKER_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1)
+    )
+
+CONF_FEATURED_SPEAKERS_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    limit=messages.IntegerField(2)
+    )
 
 SESS_BY_SPEAKER_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
@@ -291,39 +399,41 @@ class ConferenceApi(remote.Service):
         return a_form
 
 
-    def _copyConferenceToForm(self, conf, displayName):
-        """Copy relevant fields from Conference to ConferenceForm."""
+    def _copyConferenceToForm(self, conf, displayName=None):
+        """Copy relevant fields from Conference to ConferenceForm; displayName
+        is only used for conferences without a stored organizerDisplayName.
+        """
         cf = ConferenceForm()
         for field in cf.all_fields():
             if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
+                # convert Date to date string; speakers to names; just copy others
                 if field.name.endswith('Date'):
                     setattr(cf, field.name, str(getattr(conf, field.name)))
+                elif field.name == 'speakers':
+                    setattr(cf, field.name, [link.name for link in conf.speakers])
                 else:
                     setattr(cf, field.name, getattr(conf, field.name))
             elif field.name == "websafeKey":
                 setattr(cf, field.name, conf.key.urlsafe())
-        if displayName:
+        if displayName and not cf.organizerDisplayName:
             setattr(cf, 'organizerDisplayName', displayName)
         cf.check_initialized()
         return cf
 
 
-    def _createConferenceObject(self, request):
-        """Create Conference object, returning ConferenceForm/request."""
-        # preload necessary data items
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
-
+    def _conferenceData(self, request):
+        """Return the Conference property values of a ConferenceForm,
+        filling defaults into both.
+        """
         if not request.name:
             raise endpoints.BadRequestException("Conference 'name' field required")
 
         # copy ConferenceForm/ProtoRPC Message into dict
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
         del data['websafeKey']
-        del data['organizerDisplayName']
+        # speakers are counted as sessions are linked to them
+        data['speakers'] = []
+        data['speakersCounted'] = True
 
         # add default values for those missing (both data model & outbound Message)
         for df in DEFAULTS:
@@ -343,6 +453,19 @@ class ConferenceApi(remote.Service):
         # set seatsAvailable to be same as maxAttendees on creation
         if data["maxAttendees"] > 0:
             data["seatsAvailable"] = data["maxAttendees"]
+        data["seatShards"] = seats.NUM_SEAT_SHARDS
+        return data
+
+
+    def _createConferenceObject(self, request):
+        """Create Conference object, returning ConferenceForm/request."""
+        # preload necessary data items
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+
+        data = self._conferenceData(request)
         # generate Profile Key based on user ID and Conference
         # ID based on Profile key get Conference key from ID
         p_key = ndb.Key(Profile, user_id)
@@ -350,10 +473,20 @@ class ConferenceApi(remote.Service):
         c_key = ndb.Key(Conference, c_id, parent=p_key)
         data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
+        # store organiser display name with the conference so readers don't
+        # need to fetch the Profile
+        prof = p_key.get()
+        data['organizerDisplayName'] = request.organizerDisplayName = \
+            getattr(prof, 'displayName', None) or user.nickname()
 
         # create Conference, send email to organizer confirming
         # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
+        conf = Conference(**data)
+        ndb.put_multi([conf] +
+            seats.newShards(c_key, data["seatsAvailable"], data["seatShards"]))
+        self._bumpConferenceGeneration()
+        if 0 < conf.seatsAvailable <= NEARLY_SOLD_OUT_SEATS:
+            self._updateNearlySoldOut([conf])
         taskqueue.add(params={'email': user.email(),
             'conferenceInfo': repr(request)},
             url='/tasks/send_confirmation_email'
@@ -361,7 +494,7 @@ class ConferenceApi(remote.Service):
         return request
 
 
-    @ndb.transactional()
+    @ndb.transactional(xg=True)
     def _updateConferenceObject(self, request):
         """Update Conference object, returning ConferenceForm/request."""
         user = endpoints.get_current_user()
@@ -386,7 +519,13 @@ class ConferenceApi(remote.Service):
 
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
+        max_attendees = conf.maxAttendees
+        name = conf.name
         for field in request.all_fields():
+            # organizerDisplayName is maintained from the organiser Profile,
+            # seatsAvailable by registrations, speakers by session speakers
+            if field.name in ('organizerDisplayName', 'seatsAvailable', 'speakers'):
+                continue
             data = getattr(request, field.name)
             # only copy fields where we get data
             if data in ("", []):
@@ -399,9 +538,86 @@ class ConferenceApi(remote.Service):
                         conf.month = data.month
                 # write to Conference object
                 setattr(conf, field.name, data)
+        if not conf.organizerDisplayName:
+            prof = ndb.Key(Profile, user_id).get()
+            conf.organizerDisplayName = getattr(prof, 'displayName', None)
+
+        # a change of capacity adds or removes available seats; the shards
+        # are resized in this transaction, so the summary is exact
+        delta = (conf.maxAttendees or 0) - (max_attendees or 0)
+        if delta and conf.seatShards:
+            conf.seatsAvailable = seats.resize(conf, delta)
+        elif delta:
+            conf.seatsAvailable = max((conf.seatsAvailable or 0) + delta, 0)
         conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        ndb.get_context().call_on_commit(self._bumpConferenceGeneration)
+        # the announcement lists the conference by name while nearly sold out
+        if delta or (conf.name != name and
+                0 < (conf.seatsAvailable or 0) <= NEARLY_SOLD_OUT_SEATS):
+            ndb.get_context().call_on_commit(
+                lambda: self._updateNearlySoldOut([conf]))
+        return self._copyConferenceToForm(conf)
+
+
+    def _createConferenceObjects(self, request):
+        """Create Conference objects in bulk, returning ConferenceForms."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+
+        if not request.items:
+            raise endpoints.BadRequestException("Conference batch is empty")
+        if len(request.items) > MAX_CONFERENCE_BATCH:
+            raise endpoints.BadRequestException(
+                "Conference batch is limited to %d conferences" % MAX_CONFERENCE_BATCH)
+
+        # validate every conference before anything is written
+        conference_data = []
+        for i, item in enumerate(request.items):
+            try:
+                conference_data.append(self._conferenceData(item))
+            except (ValueError, endpoints.BadRequestException) as e:
+                raise endpoints.BadRequestException("Conference %d: %s" % (i, e))
+
+        # the organiser's conferences are children of their Profile; all ids
+        # are allocated in one call
+        p_key = ndb.Key(Profile, user_id)
+        first, last = Conference.allocate_ids(size=len(request.items), parent=p_key)
+        prof = p_key.get()
+        display_name = getattr(prof, 'displayName', None) or user.nickname()
+
+        conferences = []
+        entities = []
+        for c_id, item, data in zip(range(first, last + 1), request.items,
+                                    conference_data):
+            c_key = ndb.Key(Conference, c_id, parent=p_key)
+            data['key'] = c_key
+            data['organizerUserId'] = item.organizerUserId = user_id
+            data['organizerDisplayName'] = item.organizerDisplayName = display_name
+            conf = Conference(**data)
+            conferences.append(conf)
+            entities.append(conf)
+            entities.extend(seats.newShards(c_key, conf.seatsAvailable, conf.seatShards))
+        ndb.put_multi(entities)
+        self._bumpConferenceGeneration()
+        # one announcement transaction for the whole batch
+        nearly_sold_out = [conf for conf in conferences
+            if 0 < conf.seatsAvailable <= NEARLY_SOLD_OUT_SEATS]
+        if nearly_sold_out:
+            self._updateNearlySoldOut(nearly_sold_out)
+
+        # send the confirmation emails, queued in batches
+        tasks = [taskqueue.Task(params={'email': user.email(),
+                'conferenceInfo': repr(item)},
+                url='/tasks/send_confirmation_email')
+            for item in request.items]
+        queue = taskqueue.Queue()
+        for i in range(0, len(tasks), taskqueue.MAX_TASKS_PER_ADD):
+            queue.add(tasks[i:i + taskqueue.MAX_TASKS_PER_ADD])
+
+        return ConferenceForms(
+            items=[self._copyConferenceToForm(conf) for conf in conferences])
 
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
@@ -411,6 +627,13 @@ class ConferenceApi(remote.Service):
         return self._createConferenceObject(request)
 
 
+    @endpoints.method(ConferenceBatchRequest, ConferenceForms, path='conferences:batch',
+            http_method='POST', name='createConferences')
+    def createConferences(self, request):
+        """Create new conferences in bulk."""
+        return self._createConferenceObjects(request)
+
+
     @endpoints.method(CONF_POST_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='PUT', name='updateConference')
@@ -429,9 +652,12 @@ class ConferenceApi(remote.Service):
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
+        # only conferences stored before organizerDisplayName need the Profile
+        prof = None
+        if not conf.organizerDisplayName:
+            prof = conf.key.parent().get()
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        return self._copyConferenceToForm(conf, getattr(prof, 'displayName', None))
 
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
@@ -439,6 +665,15 @@ class ConferenceApi(remote.Service):
             http_method='POST', name='getConferencesCreated')
     def getConferencesCreated(self, request):
         """Return conferences created by user."""
+        return self._getConferencesCreated().get_result()
+
+
+    @ndb.tasklet
+    def _getConferencesCreated(self):
+        """Tasklet returning ConferenceForms for the conferences created by
+        the user. The Profile is only fetched for conferences stored before
+        organizerDisplayName.
+        """
         # make sure user is authed
         user = endpoints.get_current_user()
         if not user:
@@ -446,29 +681,26 @@ class ConferenceApi(remote.Service):
         user_id = getUserId(user)
 
         # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
+        p_key = ndb.Key(Profile, user_id)
+        confs = yield Conference.query(ancestor=p_key).fetch_async()
+        prof = None
+        if any(not conf.organizerDisplayName for conf in confs):
+            prof = yield p_key.get_async()
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, getattr(prof, 'displayName')) for conf in confs]
-        )
+        raise ndb.Return(ConferenceForms(
+            items=[self._copyConferenceToForm(conf, getattr(prof, 'displayName', None)) for conf in confs]
+        ))
 
 
-    def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
+    def _getQuery(self, plan):
+        """Return query for the datastore part of the given QueryPlan."""
         q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
 
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Conference.name)
-        else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Conference.name)
+        # sort orders start with the inequality field, if any
+        for field in plan.orders:
+            q = q.order(ndb.GenericProperty(field))
 
-        for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
+        for filtr in plan.filters:
             formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
             q = q.filter(formatted_query)
         return q
@@ -477,7 +709,6 @@ class ConferenceApi(remote.Service):
     def _formatFilters(self, filters):
         """Parse, check validity and format user supplied filters."""
         formatted_filters = []
-        inequality_field = None
 
         for f in filters:
             filtr = {field.name: getattr(f, field.name) for field in f.all_fields()}
@@ -488,18 +719,32 @@ class ConferenceApi(remote.Service):
             except KeyError:
                 raise endpoints.BadRequestException("Filter contains invalid field or operator.")
 
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # check if inequality operation has been used in previous filters
-                # disallow the filter if inequality was performed on a different field before
-                # track the field on which the inequality operation is performed
-                if inequality_field and inequality_field != filtr["field"]:
-                    raise endpoints.BadRequestException("Inequality filter is allowed on only one field.")
-                else:
-                    inequality_field = filtr["field"]
+            if filtr["field"] in ["month", "maxAttendees"]:
+                try:
+                    filtr["value"] = int(filtr["value"])
+                except (TypeError, ValueError):
+                    raise endpoints.BadRequestException(
+                        "Filter value for '%s' must be an integer." % filtr["field"])
 
             formatted_filters.append(filtr)
-        return (inequality_field, formatted_filters)
+        return formatted_filters
+
+
+    def _getPageParams(self, request):
+        """Return (page size, start cursor) from the submitted paging fields."""
+        page_size = request.pageSize or DEFAULT_PAGE_SIZE
+        if page_size < 1:
+            raise endpoints.BadRequestException("'pageSize' must be positive.")
+        page_size = min(page_size, MAX_PAGE_SIZE)
+
+        cursor = None
+        if request.pageToken:
+            try:
+                cursor = ndb.Cursor(urlsafe=request.pageToken)
+            except Exception:
+                raise endpoints.BadRequestException(
+                    'Invalid page token: [%s]' % request.pageToken)
+        return (page_size, cursor)
 
 
     @endpoints.method(ConferenceQueryForms, ConferenceForms,
@@ -507,24 +752,131 @@ class ConferenceApi(remote.Service):
             http_method='POST',
             name='queryConferences')
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
+        """Query for conferences, one page at a time."""
+        filters = self._formatFilters(request.filters)
+        page_size, cursor = self._getPageParams(request)
+
+        # serve repeated queries from memcache
+        cache_key = self._conferenceQueryCacheKey(filters, page_size, request.pageToken)
+        cached = memcache.get(cache_key)
+        if cached is not None:
+            return protobuf.decode_message(ConferenceForms, cached)
+
+        # inequalities on several fields are allowed; the planner decides
+        # which filters the datastore indexes can serve
+        plan = planner.plan('Conference', filters, orders=['name'])
+        logging.info('queryConferences: %s', plan)
+        q = self._getQuery(plan)
+        try:
+            forms = self._fetchConferencePage(q, page_size, cursor, plan).get_result()
+        except datastore_errors.BadRequestError:
+            # a well-formed cursor issued for other filters or orders
+            if not cursor:
+                raise
+            raise endpoints.BadRequestException(
+                'Invalid page token: [%s]' % request.pageToken)
+        if self._conferencesSettled():
+            memcache.set(cache_key, protobuf.encode_message(forms),
+                time=CONFERENCE_QUERY_CACHE_TIME)
+        return forms
+
 
-        # need to fetch organiser displayName from profiles
-        # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId)) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
+    def _conferenceQueryCacheKey(self, filters, page_size, page_token):
+        """Return the memcache key for a page of queryConferences results.
+
+        Filters are sorted so that the order in which they were submitted
+        does not matter.
+        """
+        normalized = sorted((f["field"], f["operator"], f["value"]) for f in filters)
+        digest = hashlib.sha1(json.dumps(
+            [normalized, page_size, page_token])).hexdigest()
+        return MEMCACHE_CONFERENCE_QUERY_TPL % (
+            self._getConferenceGeneration(), digest)
+
+
+    @staticmethod
+    def _getConferenceGeneration():
+        """Return the current conference generation from memcache."""
+        generation = memcache.get(MEMCACHE_CONFERENCE_GENERATION_KEY)
+        if generation is None:
+            memcache.add(MEMCACHE_CONFERENCE_GENERATION_KEY, newGeneration())
+            generation = memcache.get(MEMCACHE_CONFERENCE_GENERATION_KEY)
+        return generation
+
+
+    @staticmethod
+    def _bumpConferenceGeneration():
+        """Invalidate cached conference queries after a conference write."""
+        memcache.set(MEMCACHE_CONFERENCE_WRITTEN_KEY, time.time())
+        memcache.incr(MEMCACHE_CONFERENCE_GENERATION_KEY,
+            initial_value=newGeneration())
+
+
+    @staticmethod
+    def _conferencesSettled():
+        """Return True if conference queries are expected to reflect the
+        last conference write, so that their results may be cached.
+        """
+        written = memcache.get(MEMCACHE_CONFERENCE_WRITTEN_KEY)
+        return written is None or time.time() - written >= CONFERENCE_QUERY_SETTLE_TIME
 
+
+    @ndb.tasklet
+    def _fetchConferencePage(self, q, page_size, cursor=None, plan=None):
+        """Tasklet running q once for a page of conferences, applying the
+        in-memory filters of plan, if given.
+
+        Conferences stored before organizerDisplayName have their organiser
+        Profile requested as results stream in, so the batched get overlaps
+        the remainder of the query.
+        """
+        if plan and plan.extraFilters:
+            it = q.iter(start_cursor=cursor, produce_cursors=True,
+                batch_size=page_size + 1)
+        else:
+            it = q.iter(limit=page_size + 1, start_cursor=cursor,
+                produce_cursors=True)
+        conferences = []
+        profile_futures = []
+        next_cursor = None
+        more = False
+        scanned = 0
+        while (yield it.has_next_async()):
+            # a page stops at the scan bound even with no matches; the next
+            # page token then comes with an empty page
+            if len(conferences) >= page_size or scanned >= MAX_QUERY_SCAN:
+                more = True
+                break
+            conf = it.next()
+            scanned += 1
+            next_cursor = it.cursor_after()
+            if plan and not plan.matches(conf):
+                continue
+            conferences.append(conf)
+            if not conf.organizerDisplayName:
+                # Conference keys are children of the organiser Profile key
+                profile_futures.append(conf.key.parent().get_async())
+        profiles = yield profile_futures
+
+        # return individual ConferenceForm object per Conference
+        raise ndb.Return(ConferenceForms(
+            items=self._copyConferencesToForms(conferences, profiles),
+            nextPageToken=next_cursor.urlsafe() if (more and next_cursor) else None
+        ))
+
+
+    def _copyConferencesToForms(self, conferences, profiles):
+        """Copy Conferences to ConferenceForms, falling back to the organiser
+        display name from profiles where the conference has none stored.
+        """
         # put display names in a dict for easier fetching
         names = {}
         for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+            if profile:
+                names[profile.key.id()] = profile.displayName
 
-        # return individual ConferenceForm object per Conference
-        return ConferenceForms(
-                items=[self._copyConferenceToForm(conf, names[conf.organizerUserId]) for conf in \
-                conferences]
-        )
+        return [self._copyConferenceToForm(conf, names.get(conf.organizerUserId))
+                for conf in conferences if conf]
 
 
 # - - - Profile objects - - - - - - - - - - - - - - - - - - -
@@ -538,6 +890,9 @@ class ConferenceApi(remote.Service):
                 # convert t-shirt string to Enum; just copy others
                 if field.name == 'teeShirtSize':
                     setattr(pf, field.name, getattr(TeeShirtSize, getattr(prof, field.name)))
+                elif field.name == 'sessionWishlist':
+                    setattr(pf, field.name, [key.urlsafe()
+                        for key in self._getWishlistKeys(prof)])
                 else:
                     setattr(pf, field.name, getattr(prof, field.name))
         pf.check_initialized()
@@ -551,6 +906,14 @@ class ConferenceApi(remote.Service):
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
 
+        # the Profile read earlier in this request is reused; a transaction
+        # reads its own copy, which it may write
+        memo = getattr(self, '_profileMemo', None)
+        if ndb.in_transaction():
+            self._profileMemo = memo = None
+        elif memo and memo[0] == user.email():
+            return memo[1]
+
         # get Profile from datastore
         user_id = getUserId(user)
         p_key = ndb.Key(Profile, user_id)
@@ -565,6 +928,8 @@ class ConferenceApi(remote.Service):
             )
             profile.put()
 
+        if not ndb.in_transaction():
+            self._profileMemo = (user.email(), profile)
         return profile      # return Profile
 
 
@@ -572,19 +937,28 @@ class ConferenceApi(remote.Service):
         """Get user Profile and return to user, possibly updating it first."""
         # get user Profile
         prof = self._getProfileFromUser()
+        display_name = prof.displayName
 
         # if saveProfile(), process user-modifyable fields
         if save_request:
+            changed = False
             for field in ('displayName', 'teeShirtSize'):
                 if hasattr(save_request, field):
                     val = getattr(save_request, field)
-                    if val:
+                    if val and getattr(prof, field) != str(val):
                         setattr(prof, field, str(val))
                         #if field == 'teeShirtSize':
                         #    setattr(prof, field, str(val).upper())
                         #else:
                         #    setattr(prof, field, val)
-                        prof.put()
+                        changed = True
+            # one put for all the fields saved
+            if changed:
+                prof.put()
+
+            # conferences carry a copy of the organiser display name
+            if prof.displayName != display_name:
+                propagation.schedule(prof.key)
 
         # return ProfileForm
         return self._copyProfileToForm(prof)
@@ -604,31 +978,160 @@ class ConferenceApi(remote.Service):
         return self._doProfile(request)
 
 
+    @staticmethod
+    def _propagate(step, websafeKey, websafeCursor=None):
+        """Propagate a renamed or deleted entity to one batch of the
+        entities linking to it; used by the propagate task. Returns the
+        websafe cursor of the next batch, or None when done.
+        """
+        cursor, changed = propagation.run(step, websafeKey, websafeCursor)
+
+        conf_keys = set(key for key in changed if key.kind() == 'Conference')
+        if conf_keys:
+            ConferenceApi._bumpConferenceGeneration()
+            # featured speakers hold a copy of the speaker names
+            memcache.delete_multi([MEMCACHE_FEATURED_SPEAKERS_TPL % key.urlsafe()
+                for key in conf_keys])
+        for conf_key in set(key.parent() for key in changed
+                            if key.kind() == 'Session'):
+            refreshSnapshot(conf_key)
+        return cursor
+
+
+    @ndb.transactional(xg=True)
+    def _putUnique(self, entity, message, old_value=None):
+        """Put entity (its key complete) while claiming the value of its
+        unique field, releasing old_value; raises BadRequestException with
+        message if another entity holds the value.
+
+        Entities stored before the markers claim their value on their first
+        put, so the backfill task may run after deploying. Those already
+        sharing a value with another entity keep it, but can't take
+        another holder's value.
+        """
+        kind = entity._get_kind()
+        value = getattr(entity, UNIQUE_FIELDS[kind])
+        kept = old_value and unique.markerKey(kind, old_value) == unique.markerKey(kind, value)
+        if not unique.claim(kind, value, entity.key) and not kept:
+            raise endpoints.BadRequestException(message)
+        if old_value and not kept:
+            unique.release(kind, old_value, entity.key)
+        entity.put()
+
+
+    @staticmethod
+    def _reindexEntities(kind, websafeCursor=None):
+        """Put one batch of entities again, so that indexes and computed
+        properties added since they were stored are written; used by the
+        reindex_entities task. Returns the websafe cursor of the next
+        batch, or None when done.
+        """
+        if kind not in REINDEXED_KINDS:
+            raise ValueError('Unknown reindexed kind: %s' % kind)
+        cursor = ndb.Cursor(urlsafe=websafeCursor) if websafeCursor else None
+        entities, next_cursor, more = ndb.Query(kind=kind).fetch_page(
+            propagation.BATCH_SIZE, start_cursor=cursor)
+        ndb.put_multi(entities)
+        if more and next_cursor:
+            return next_cursor.urlsafe()
+        return None
+
+
+    @staticmethod
+    def _backfillUniqueValues(kind, websafeCursor=None):
+        """Claim the unique field values of one batch of entities stored
+        before uniqueness markers; used by the backfill_unique_values task.
+        Returns the websafe cursor of the next batch, or None when done.
+        """
+        field = UNIQUE_FIELDS[kind]
+        cursor = ndb.Cursor(urlsafe=websafeCursor) if websafeCursor else None
+        entities, next_cursor, more = ndb.Query(kind=kind).fetch_page(
+            propagation.BATCH_SIZE, start_cursor=cursor)
+
+        # the first entity stored with a value keeps it
+        ndb.Future.wait_all([UniqueValue.get_or_insert_async(
+                unique.markerKey(kind, getattr(entity, field)).id(),
+                target=entity.key)
+            for entity in entities if getattr(entity, field, None)])
+        if more and next_cursor:
+            return next_cursor.urlsafe()
+        return None
+
+
 # - - - Announcements - - - - - - - - - - - - - - - - - - - -
 
     @staticmethod
-    def _cacheAnnouncement():
+    def _loadAnnouncement():
+        """Return the Announcement entity, seeding it from a scan of the
+        conferences the first time.
+        """
+        announcement = ndb.Key(Announcement, ANNOUNCEMENT_ID).get()
+        if announcement is None:
+            confs = Conference.query(ndb.AND(
+                Conference.seatsAvailable <= NEARLY_SOLD_OUT_SEATS,
+                Conference.seatsAvailable > 0)
+            ).fetch(projection=[Conference.name])
+            announcement = Announcement.get_or_insert(ANNOUNCEMENT_ID,
+                conferences=[ConferenceLink(name=conf.name,
+                    websafeKey=conf.key.urlsafe()) for conf in confs])
+        return announcement
+
+
+    @staticmethod
+    def _cacheAnnouncement(announcement=None):
         """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
+        memcache cron job, getAnnouncement() & _updateNearlySoldOut().
         """
-        confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
-            Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
+        if announcement is None:
+            announcement = ConferenceApi._loadAnnouncement()
 
-        if confs:
+        if announcement.conferences:
             # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = ANNOUNCEMENT_TPL % (
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
+            # format announcement
+            text = ANNOUNCEMENT_TPL % (
+                ', '.join(link.name for link in announcement.conferences))
         else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+            text = ""
+        # an empty announcement is cached too, so readers don't rebuild it
+        memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, text)
+        return text
 
-        return announcement
+
+    @staticmethod
+    def _updateNearlySoldOut(conferences):
+        """Add conferences to or remove them from the nearly sold out
+        conferences as their seatsAvailable cross the threshold, in one
+        transaction; write the announcement through to memcache if it
+        changed.
+        """
+        ConferenceApi._loadAnnouncement()
+        links = {}
+        for conf in conferences:
+            wsck = conf.key.urlsafe()
+            if 0 < (conf.seatsAvailable or 0) <= NEARLY_SOLD_OUT_SEATS:
+                links[wsck] = [ConferenceLink(name=conf.name, websafeKey=wsck)]
+            else:
+                links[wsck] = []
+
+        @ndb.transactional()
+        def _update():
+            announcement = ndb.Key(Announcement, ANNOUNCEMENT_ID).get()
+            current = {}
+            for l in announcement.conferences:
+                if l.websafeKey in links:
+                    current.setdefault(l.websafeKey, []).append(l)
+            if all(current.get(wsck, []) == new for wsck, new in links.items()):
+                return None
+            others = [l for l in announcement.conferences if l.websafeKey not in links]
+            announcement.conferences = sorted(
+                others + [l for new in links.values() for l in new],
+                key=lambda l: l.name)
+            announcement.put()
+            return announcement
+
+        announcement = _update()
+        if announcement:
+            ConferenceApi._cacheAnnouncement(announcement)
 
 
     @endpoints.method(message_types.VoidMessage, StringMessage,
@@ -636,17 +1139,17 @@ class ConferenceApi(remote.Service):
             http_method='GET', name='getAnnouncement')
     def getAnnouncement(self, request):
         """Return Announcement from memcache."""
-        return StringMessage(data=memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or "")
+        announcement = memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY)
+        if announcement is None:
+            # evicted or never set; rebuild from the stored conferences
+            announcement = self._cacheAnnouncement()
+        return StringMessage(data=announcement)
 
 
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
-    @ndb.transactional(xg=True)
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
-        retval = None
-        prof = self._getProfileFromUser() # get user Profile
-
         # check if conf exists given websafeConfKey
         # get conference; check that it exists
         wsck = request.websafeConferenceKey
@@ -655,6 +1158,53 @@ class ConferenceApi(remote.Service):
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
 
+        # check if user already registered before looking for a seat
+        prof = self._getProfileFromUser() # get user Profile
+        if reg and wsck in prof.conferenceKeysToAttend:
+            raise ConflictException(
+                "You have already registered for this conference")
+
+        # admission mode: the drain task allocates the seat; the client
+        # polls getRegistrationStatus for the outcome
+        if reg and conf.registrationQueued:
+            admission.enqueue(wsck, prof.key.id())
+            return BooleanMessage(data=True)
+
+        # conferences created before seat sharding get their shards now
+        if not conf.seatShards:
+            conf = seats.ensureShards(conf.key)
+
+        # seats are taken from (or given back to) a random shard, so that
+        # concurrent registrations write to different entity groups
+        retval = None
+        for shard_key in seats.candidateShards(conf, available=reg):
+            retval = self._shardRegistration(wsck, shard_key, reg)
+            if retval is not None:
+                break
+
+        if retval is None:
+            # check if seats avail
+            raise ConflictException(
+                "There are no seats available.")
+
+        if retval:
+            seats.scheduleReconcile(conf.key)
+        if retval and not reg:
+            # forget a queued registration, so it isn't reported as confirmed
+            res_key = ndb.Key(Reservation, prof.key.id(), parent=conf.key)
+            if res_key.get():
+                res_key.delete()
+        return BooleanMessage(data=retval)
+
+
+    @ndb.transactional(xg=True)
+    def _shardRegistration(self, wsck, shard_key, reg=True):
+        """Register or unregister user against one seat shard; return None
+        if the shard has no seat left.
+        """
+        prof = self._getProfileFromUser() # get user Profile
+        shard = shard_key.get()
+
         # register
         if reg:
             # check if user already registered otherwise add
@@ -662,31 +1212,146 @@ class ConferenceApi(remote.Service):
                 raise ConflictException(
                     "You have already registered for this conference")
 
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
-                raise ConflictException(
-                    "There are no seats available.")
+            if shard.seatsAvailable <= 0:
+                return None
 
             # register user, take away one seat
             prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
-            retval = True
+            shard.seatsAvailable -= 1
 
         # unregister
         else:
             # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
+            if wsck not in prof.conferenceKeysToAttend:
+                return False
 
-                # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
-                retval = True
-            else:
-                retval = False
+            # unregister user, add back one seat
+            prof.conferenceKeysToAttend.remove(wsck)
+            shard.seatsAvailable += 1
 
         # write things back to the datastore & return
-        ndb.put_multi([prof, conf])
-        return BooleanMessage(data=retval)
+        ndb.put_multi([prof, shard])
+        return True
+
+
+    @staticmethod
+    def _reconcileSeats(websafeConferenceKey):
+        """Copy the seats available across a conference's shards to
+        Conference.seatsAvailable; used by the reconcile_seats task.
+        """
+        conf_key = ndb.Key(urlsafe=websafeConferenceKey)
+        conf = conf_key.get()
+        if not conf or not conf.seatShards:
+            return
+        seats_available = seats.countSeats(conf)
+
+        @ndb.transactional()
+        def _update():
+            conf = conf_key.get()
+            if conf.seatsAvailable == seats_available:
+                return None
+            conf.seatsAvailable = seats_available
+            conf.put()
+            return conf
+
+        conf = _update()
+        if conf:
+            # seatsAvailable is part of cached query results
+            ConferenceApi._bumpConferenceGeneration()
+            ConferenceApi._updateNearlySoldOut([conf])
+
+
+    @staticmethod
+    def _drainRegistrations():
+        """Decide a leased batch of queued registrations, batched writes per
+        conference; return True if the queue may hold more.
+        """
+        leased, batches = admission.lease()
+        for wsck, tasks, user_ids in batches:
+            try:
+                ConferenceApi._admitRegistrations(wsck, user_ids)
+            except Exception:
+                # tasks are leased again once the lease expires
+                logging.exception('registrations for %s not admitted', wsck)
+                continue
+            admission.delete(tasks)
+        return leased == admission.LEASE_BATCH
+
+
+    @staticmethod
+    def _admitRegistrations(wsck, user_ids):
+        """Allocate seats of the conference to queued users in queue order,
+        recording a Reservation for each.
+        """
+        conf_key = ndb.Key(urlsafe=wsck)
+        conf = conf_key.get()
+        if not conf:
+            admission.clearPending(wsck, user_ids)
+            return
+        if not conf.seatShards:
+            conf = seats.ensureShards(conf_key)
+
+        # users already holding a seat (registered, or confirmed before a
+        # failed drain) take none
+        profiles = ndb.get_multi([ndb.Key(Profile, u) for u in user_ids])
+        reservations = ndb.get_multi(
+            [ndb.Key(Reservation, u, parent=conf_key) for u in user_ids])
+        waiting = [u for u, prof, res in zip(user_ids, profiles, reservations)
+            if not (prof and wsck in prof.conferenceKeysToAttend)
+            and not (res and res.status == 'CONFIRMED')]
+
+        # transactions over the conference group and its seat shards, each
+        # deciding a chunk of users in queue order
+        @ndb.transactional(xg=True)
+        def _allocate(chunk):
+            shards = [shard for shard in
+                ndb.get_multi(seats.shardKeys(conf_key, conf.seatShards)) if shard]
+            taken = seats.takeSeats(shards, len(chunk))
+            ndb.put_multi(shards + [Reservation(id=u, parent=conf_key,
+                    status='CONFIRMED' if i < taken else 'REJECTED')
+                for i, u in enumerate(chunk)])
+            return chunk[:taken]
+
+        confirmed = []
+        for i in range(0, len(waiting), admission.ADMIT_BATCH):
+            confirmed.extend(_allocate(waiting[i:i + admission.ADMIT_BATCH]))
+
+        # profiles are separate entity groups, updated in parallel
+        @ndb.transactional_tasklet
+        def _attend(p_key):
+            prof = yield p_key.get_async()
+            if prof and wsck not in prof.conferenceKeysToAttend:
+                prof.conferenceKeysToAttend.append(wsck)
+                yield prof.put_async()
+
+        # confirmed now, or before a drain that failed to update profiles
+        attending = confirmed + [u for u, res in zip(user_ids, reservations)
+            if res and res.status == 'CONFIRMED']
+        ndb.Future.wait_all([_attend(ndb.Key(Profile, u)) for u in attending])
+        admission.clearPending(wsck, user_ids)
+        if confirmed:
+            seats.scheduleReconcile(conf_key)
+
+
+    @endpoints.method(CONF_GET_REQUEST, RegistrationStatusForm,
+            path='conference/{websafeConferenceKey}/registration',
+            http_method='GET', name='getRegistrationStatus')
+    def getRegistrationStatus(self, request):
+        """Get the status of the user's registration for the conference."""
+        wsck = request.websafeConferenceKey
+        prof = self._getProfileFromUser() # get user Profile
+        if wsck in prof.conferenceKeysToAttend:
+            status = RegistrationStatus.CONFIRMED
+        elif admission.isPending(wsck, prof.key.id()):
+            status = RegistrationStatus.PENDING
+        else:
+            conf = self._getConference(wsck)
+            if not conf:
+                raise endpoints.NotFoundException(
+                    'No conference found with key: %s' % wsck)
+            res = ndb.Key(Reservation, prof.key.id(), parent=conf.key).get()
+            status = getattr(RegistrationStatus, res.status if res else 'NONE')
+        return RegistrationStatusForm(websafeConferenceKey=wsck, status=status)
 
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
@@ -694,23 +1359,24 @@ class ConferenceApi(remote.Service):
             http_method='GET', name='getConferencesToAttend')
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
+        return self._getConferencesToAttend().get_result()
+
+
+    @ndb.tasklet
+    def _getConferencesToAttend(self):
+        """Tasklet returning ConferenceForms for the user's registrations."""
         prof = self._getProfileFromUser() # get user Profile
         conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
-
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
+        conferences = yield ndb.get_multi_async(conf_keys)
 
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        # organisers are the conference key parents; only conferences stored
+        # before organizerDisplayName need them
+        profiles = yield ndb.get_multi_async([conf.key.parent()
+            for conf in conferences if conf and not conf.organizerDisplayName])
 
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(conf, names[conf.organizerUserId])\
-         for conf in conferences]
-        )
+        raise ndb.Return(ConferenceForms(
+            items=self._copyConferencesToForms(conferences, profiles)))
 
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
@@ -771,6 +1437,29 @@ class ConferenceApi(remote.Service):
         return a_form
 
 
+    def _copySnapshotRowToForm(self, a_snapshot, row):
+        """Copy a SessionSnapshot row to SessionResponse."""
+        values = a_snapshot.session(row)
+        a_form = SessionResponse()
+        for field in a_form.all_fields():
+            if field.name in ('date', 'startTime', 'endTime'):
+                setattr(a_form, field.name, str(values[field.name]))
+            elif field.name == 'speakers':
+                speakerLinks=[SpeakerLinkResponse(websafeKey=websafeKey, name=name)
+                    for (websafeKey, name) in values[field.name]]
+                setattr(a_form, field.name, speakerLinks)
+            else:
+                setattr(a_form, field.name, values[field.name])
+        a_form.check_initialized()
+        return a_form
+
+
+    def _copySnapshotToForms(self, a_snapshot, rows):
+        """Return SessionListResponse for the given SessionSnapshot rows."""
+        return SessionListResponse(
+            items=[self._copySnapshotRowToForm(a_snapshot, row) for row in rows])
+
+
     def _storeSessionObject(self, request):
         """Create conference session object, return SessionResponse/request."""
 
@@ -782,11 +1471,6 @@ class ConferenceApi(remote.Service):
             raise endpoints.BadRequestException(
                 "Conference session 'name' field required")
 
-        # check for duplicate
-        if Session.query(Session.name == request.name).get():
-            raise endpoints.BadRequestException(
-                "Duplicate conference session 'name'")
-
         # copy request input to  dict
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
         # remove extraneous input field data
@@ -803,9 +1487,10 @@ class ConferenceApi(remote.Service):
         session_id = Session.allocate_ids(size=1, parent=a_conference.key)[0]
         session_key = ndb.Key(Session, session_id, parent=a_conference.key)
         data['key'] = session_key
-        # create session
+        # create session, claiming its name; checks for duplicate
         a_session = Session(**data)
-        a_session.put()
+        self._putUnique(a_session, "Duplicate conference session 'name'")
+        refreshSnapshot(a_conference.key)
 
         return a_session
         # return self._copySessionToForm(a_session)
@@ -822,6 +1507,8 @@ class ConferenceApi(remote.Service):
 
         user = self._getUser()
         a_session = self._getSession(request.websafeSessionKey)
+        old_name = a_session.name
+        old_slot = schedule.slotFor(a_session)
 
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from SessionResponse to a ConferenceSession object
@@ -841,14 +1528,21 @@ class ConferenceApi(remote.Service):
                 # write to Conference object
                 setattr(a_session, field.name, data)
 
-        a_session.put()
-        # TODO: update areas with SessionLinks
-        # update speaker sessions
-        # update wishlists
+        if not a_session.name:
+            raise endpoints.BadRequestException(
+                "Conference session 'name' field required")
+        self._putUnique(a_session, "Duplicate conference session 'name'",
+            old_name)
+        refreshSnapshot(a_session.key.parent())
+        if a_session.speakers and old_slot != schedule.slotFor(a_session):
+            self._rescheduleSpeakers(a_session)
+        # speaker sessions and wishlists link to the session by name
+        if a_session.name != old_name:
+            propagation.schedule(a_session.key)
         return self._copySessionToForm(a_session)
 
 
-    @ndb.transactional()
+    @ndb.transactional(xg=True)
     def _destroySessionObject(self, request):
         """destroy conference session object, return SessionResponse"""
 
@@ -856,9 +1550,19 @@ class ConferenceApi(remote.Service):
         a_session= self._getSession(request.websafeSessionKey)
 
         a_conference = a_session.key.parent().get()
-        a_conference.sessions.remove(a_session.key.urlsafe())
+        if a_session.key.urlsafe() in a_conference.sessions:
+            a_conference.sessions.remove(a_session.key.urlsafe())
+        self._addConferenceSpeakers(a_conference, a_session.speakers, -1)
         a_conference.put()
         a_session.key.delete()
+        unique.release('Session', a_session.name, a_session.key)
+        ndb.get_context().call_on_commit(self._bumpConferenceGeneration)
+        ndb.get_context().call_on_commit(lambda: refreshSnapshot(a_conference.key))
+        # the featured speakers are recounted on the next read
+        ndb.get_context().call_on_commit(lambda: memcache.delete(
+            MEMCACHE_FEATURED_SPEAKERS_TPL % a_conference.key.urlsafe()))
+        # unlink the session from speakers (and their schedules) and wishlists
+        propagation.schedule(a_session.key, deleted=True)
 
         return self._copySessionToForm(a_session)
 
@@ -873,6 +1577,223 @@ class ConferenceApi(remote.Service):
         return self._copySessionToForm(session)
 
 
+    def _parseSessionBatch(self, request):
+        """Return the sessions of a batch request as SessionResponse items."""
+        if request.csv and request.items:
+            raise endpoints.BadRequestException(
+                "Pass one of 'items' or 'csv' exclusively")
+        if not request.csv:
+            return list(request.items)
+
+        items = []
+        reader = csv.DictReader(StringIO(request.csv.encode('utf-8')))
+        for row in reader:
+            a_form = SessionResponse()
+            for field, value in row.items():
+                if not field or value is None:
+                    continue
+                field = field.strip()
+                value = value.decode('utf-8').strip()
+                if field == 'speakers':
+                    a_form.speakers = [SpeakerLinkResponse(websafeKey=wssk.strip())
+                        for wssk in value.split(';') if wssk.strip()]
+                elif field == 'duration':
+                    a_form.duration = int(value) if value else None
+                elif field in ('name', 'highlights', 'typeOfSession',
+                               'date', 'startTime'):
+                    setattr(a_form, field, value or None)
+                else:
+                    raise endpoints.BadRequestException(
+                        "Unknown session batch column '%s'" % field)
+            items.append(a_form)
+        return items
+
+
+    def _storeSessionBatch(self, request):
+        """Create conference session objects in bulk, return
+        SessionListResponse
+        """
+        user = self._getUser()
+        a_conference = self._getConference(request.websafeConferenceKey)
+        if not a_conference:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % request.websafeConferenceKey)
+
+        try:
+            items = self._parseSessionBatch(request)
+        except (csv.Error, ValueError) as e:
+            raise endpoints.BadRequestException("Invalid session batch: %s" % e)
+        if not items:
+            raise endpoints.BadRequestException("Session batch is empty")
+        if len(items) > MAX_SESSION_BATCH:
+            raise endpoints.BadRequestException(
+                "Session batch is limited to %d sessions" % MAX_SESSION_BATCH)
+
+        # validate every session before anything is written
+        names = set()
+        speaker_keys = set()
+        for i, item in enumerate(items):
+            if not item.name:
+                raise endpoints.BadRequestException(
+                    "Session %d: 'name' field required" % i)
+            normalized = unique.normalize(item.name)
+            if normalized in names:
+                raise endpoints.BadRequestException(
+                    "Session %d: duplicate conference session 'name'" % i)
+            names.add(normalized)
+            if len(set(link.websafeKey for link in item.speakers)) < len(item.speakers):
+                raise endpoints.BadRequestException(
+                    "Session %d: duplicate speaker" % i)
+            try:
+                speaker_keys.update(ndb.Key(urlsafe=link.websafeKey)
+                    for link in item.speakers)
+            except Exception:
+                raise endpoints.BadRequestException(
+                    "Session %d: invalid speaker key" % i)
+
+        # one batched get each for the name markers and the speakers
+        markers = ndb.get_multi([unique.markerKey('Session', item.name) for item in items])
+        taken = [item.name for item, marker in zip(items, markers) if marker]
+        if taken:
+            raise endpoints.BadRequestException(
+                "Duplicate conference session 'name': %s" % ', '.join(taken))
+        speaker_keys = list(speaker_keys)
+        speakers = dict((key, speaker) for key, speaker in
+            zip(speaker_keys, ndb.get_multi(speaker_keys)) if speaker)
+        missing = [key.urlsafe() for key in speaker_keys if key not in speakers]
+        if missing:
+            raise endpoints.BadRequestException(
+                "No speaker found with key: %s" % ', '.join(missing))
+
+        # allocate all session ids in one call
+        first, last = Session.allocate_ids(size=len(items), parent=a_conference.key)
+        sessions = []
+        for session_id, item in zip(range(first, last + 1), items):
+            try:
+                sessions.append(Session(
+                    key=ndb.Key(Session, session_id, parent=a_conference.key),
+                    name=item.name,
+                    highlights=item.highlights,
+                    duration=item.duration,
+                    typeOfSession=item.typeOfSession or 'NOT_SPECIFIED',
+                    date=predicates.parseDate(item.date),
+                    startTime=predicates.parseTime(item.startTime)
+                        if item.startTime else None,
+                    speakers=[SpeakerLink(
+                            name=speakers[ndb.Key(urlsafe=link.websafeKey)].name,
+                            websafeKey=link.websafeKey)
+                        for link in item.speakers]))
+            except ValueError as e:
+                raise endpoints.BadRequestException(
+                    "Session %d: %s" % (len(sessions), e))
+
+        # speakers linked before schedules were kept get one first
+        for key, speaker in speakers.items():
+            if not speaker.scheduleBuilt:
+                self._buildSpeakerSchedule(key)
+                speakers[key] = key.get()
+
+        # check no speaker is in two sessions at the same time, against
+        # their schedules and the rows before
+        session_names = dict((link.websafeKey, link.name)
+            for speaker in speakers.values() for link in speaker.sessions)
+        for i, a_session in enumerate(sessions):
+            session_names[a_session.key.urlsafe()] = a_session.name
+            slot = schedule.slotFor(a_session)
+            if not slot:
+                continue
+            for link in a_session.speakers:
+                speaker = speakers[ndb.Key(urlsafe=link.websafeKey)]
+                clashes = schedule.conflicts(speaker, slot)
+                if clashes:
+                    raise ConflictException(
+                        "Session %d: speaker %s is in another session at that time: %s" % (
+                            i, speaker.name, ', '.join(
+                                session_names.get(other.websafeKey, other.websafeKey)
+                                for other in clashes)))
+                # only the copy read here; speakers are linked below
+                schedule.addSlot(speaker, slot)
+
+        # sessions and their name markers, one transaction per chunk: the
+        # conference group plus one group per marker
+        chunk_size = XG_TRANSACTION_GROUPS - 1
+        stored = 0
+        error = None
+        for i in range(0, len(sessions), chunk_size):
+            try:
+                self._putSessionChunk(sessions[i:i + chunk_size])
+            except (endpoints.BadRequestException, datastore_errors.Error) as e:
+                if not stored:
+                    raise
+                error = e
+                break
+            stored = min(i + chunk_size, len(sessions))
+        sessions = sessions[:stored]
+
+        # link the speakers of the stored sessions, one transaction per
+        # chunk of speakers
+        speaker_sessions = {}
+        for a_session in sessions:
+            for link in a_session.speakers:
+                speaker_sessions.setdefault(link.websafeKey, []).append(a_session)
+        speaker_keys = [ndb.Key(urlsafe=wssk) for wssk in speaker_sessions]
+        for i in range(0, len(speaker_keys), XG_TRANSACTION_GROUPS):
+            self._linkSessionSpeakers(speaker_keys[i:i + XG_TRANSACTION_GROUPS],
+                speaker_sessions)
+
+        refreshSnapshot(a_conference.key)
+        # the featured speakers are recounted on the next read
+        memcache.delete(MEMCACHE_FEATURED_SPEAKERS_TPL % a_conference.key.urlsafe())
+        if error:
+            # the chunks before the failing one are stored, and stay so
+            raise endpoints.BadRequestException(
+                "Sessions 0 to %d were stored, sessions %d to %d were not: %s" % (
+                    stored - 1, stored, len(items) - 1, error))
+        return SessionListResponse(
+            items=[self._copySessionToForm(a_session) for a_session in sessions])
+
+
+    @ndb.transactional(xg=True)
+    def _putSessionChunk(self, sessions):
+        """Put sessions of one conference while claiming their names and
+        counting their speakers.
+        """
+        for a_session in sessions:
+            if not unique.claim('Session', a_session.name, a_session.key):
+                raise endpoints.BadRequestException(
+                    "Duplicate conference session 'name': %s" % a_session.name)
+        a_conference = sessions[0].key.parent().get()
+        self._addConferenceSpeakers(a_conference,
+            [link for a_session in sessions for link in a_session.speakers])
+        ndb.put_multi(sessions + [a_conference])
+        ndb.get_context().call_on_commit(self._bumpConferenceGeneration)
+
+
+    @ndb.transactional(xg=True)
+    def _linkSessionSpeakers(self, speaker_keys, speaker_sessions):
+        """Link speakers to their sessions (by speaker websafeKey), adding
+        the sessions to the speakers' schedules.
+        """
+        speakers = ndb.get_multi(speaker_keys)
+        for speaker in speakers:
+            for a_session in speaker_sessions.get(speaker.key.urlsafe(), []):
+                speaker.sessions.append(SessionLink(
+                    name=a_session.name, websafeKey=a_session.key.urlsafe()))
+                slot = schedule.slotFor(a_session)
+                if slot:
+                    schedule.addSlot(speaker, slot)
+        ndb.put_multi(speakers)
+
+
+    @endpoints.method(CONF_SESS_BATCH_REQUEST, SessionListResponse,
+        path='conference/{websafeConferenceKey}/sessions:batch',
+        http_method='POST',
+        name='createSessions')
+    def createSessions(self, request):
+        """Create conference sessions in bulk"""
+        return self._storeSessionBatch(request)
+
+
     @endpoints.method(CONF_SESS_SHOW_REQUEST, SessionResponse,
         path='conference/session/{websafeSessionKey}',
         http_method='GET',
@@ -903,11 +1824,8 @@ class ConferenceApi(remote.Service):
     def _listConferenceSessions(self, request):
         """Get list of session objects, return SessionListResponse"""
         a_conference_key = ndb.Key(urlsafe=request.websafeConferenceKey)
-        session_list = Session.query(ancestor=a_conference_key).fetch()
-
-        return SessionListResponse(
-            items=[self._copySessionToForm(session) for session in session_list]
-        )
+        a_snapshot = getSnapshot(a_conference_key)
+        return self._copySnapshotToForms(a_snapshot, xrange(len(a_snapshot)))
 
 
     @endpoints.method(CONF_SESS_INDEX_REQUEST, SessionListResponse,
@@ -925,45 +1843,18 @@ class ConferenceApi(remote.Service):
 #
 
     def _getConferenceSessionQuery(self, request):
-        """Return query from subitted filters."""
+        """Return (snapshot, matching rows) for the submitted filters."""
         ws_conference_key = ndb.Key(urlsafe=request.websafeConferenceKey)
-        q = Session.query(ancestor=ws_conference_key)
-        inequality_filter, filters, extra_filters = self._formatSessionFilters(request.filters)
-        
-        if inequality_filter:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-
-        for filterObject in filters:
-            if filterObject["field"] in ["duration"]:
-                filterObject["value"] = int(filterObject["value"])
-            formatted_query = ndb.query.FilterNode(filterObject["field"], filterObject["operator"], filterObject["value"])
-            q = q.filter(formatted_query)
-
-        session_list = q.fetch()
-
-        if extra_filters:
-            for filterObject in extra_filters:
-                filterField = filterObject["field"]
-                if filterField in ["duration"]:
-                    aFilter = self._sessionFilter(filterObject, INT)
-                elif filterField in ["startTime", "endTime"]:
-                    aFilter = self._sessionFilter(filterObject, TIME)
-                elif filterField in ["date"]:
-                    aFilter = self._sessionFilter(filterObject, DATE)
-                else:
-                    aFilter = self._sessionFilter(filterObject)
-                session_list = filter(aFilter, session_list)
-                session_list = sorted(session_list, key=lambda session: getattr(session, filterField))
+        filters = self._formatSessionFilters(request.filters)
 
-        session_list = sorted(session_list, key=lambda session: getattr(session, "name"))
-
-        return session_list
+        # filter the conference's session snapshot in a single pass; its
+        # rows are already in name order
+        a_snapshot = getSnapshot(ws_conference_key)
+        return (a_snapshot, a_snapshot.select(filters))
 
     def _formatSessionFilters(self, filters):
         """Parse and format user supplied filters"""
         formatted_filters = []
-        inequality_filter = None
-        extra_inequality_filters = []
 
         for filterObject in filters:
             filterObject = {field.name: getattr(filterObject, field.name) for field in filterObject.all_fields()}
@@ -974,93 +1865,20 @@ class ConferenceApi(remote.Service):
             except KeyError:
                 raise endpoints.BadRequestException("Filter contains invalid field or operator.")
 
-            # Every operation except "=" is an inequality
-            if filterObject["operator"] != "=":
-                # check if inequality operation has been used in previous filters
-                # disallow the filter if inequality was performed on a different field before
-                # track the field on which the inequality operation is performed
-                if inequality_filter:
-                    extra_inequality_filters.append(filterObject)
-                else:
-                    inequality_filter = filterObject["field"]
-                    formatted_filters.append(filterObject)
-            else:
-                formatted_filters.append(filterObject)
-
-        return (inequality_filter, formatted_filters, extra_inequality_filters)
-
-
-    def _sessionFilter(self, filterObject, type=STRING):
-        """Factory function to return appropriate filter function"""
-        if type == INT:
-            return self._sessionFilterInt(filterObject)
-
-        if type == TIME:
-            return self._sessionFilterTime(filterObject)
-
-        if type == DATE:
-            return self._sessionFilterDate(filterObject)
-
-        return self._sessionFilterString(filterObject)
-
-
-    def _sessionFilterString(self, filterObject):
-        """Generate Session string filter"""
-        _field = filterObject["field"]
-        _operator = filterObject["operator"]
-        _value = filterObject["value"]
-
-        def aFilter(record):
-            # %r to prevent code injection
-            return eval("record.%s %s %r" % (_field, _operator, _value))
-
-        return aFilter
-
-
-    def _sessionFilterInt(self, filterObject):
-        """Generate Session integer filter"""
-        _field = filterObject["field"]
-        _operator = filterObject["operator"]
-        _value = int(filterObject["value"])
-
-        def aFilter(record):
-            value = _value
-            return eval("record.%s %s value" % (_field, _operator))
-
-        return aFilter
-
-
-    def _sessionFilterTime(self, filterObject):
-        """Generate Session time filter"""
-        _field = filterObject["field"]
-        _operator = filterObject["operator"]
-        _value = datetime.strptime(filterObject["value"], "%H:%M").time()
-        def aFilter(record):
-            target = getattr(record, _field)
-            value = _value
-            # TODO: check for None values.
-            # may have to separate check for != and other
-            return eval("target %s value" % _operator)
-
-        return aFilter
-
+            # parse the value once, for both datastore and in-memory filters
+            try:
+                filterObject["value"] = predicates.parseValue(filterObject["value"],
+                    SESSION_FIELD_TYPES[filterObject["field"]])
+            except ValueError:
+                raise endpoints.BadRequestException(
+                    "Filter contains invalid value for '%s'." % filterObject["field"])
+            if filterObject["value"] is None and filterObject["operator"] not in ("=", "!="):
+                raise endpoints.BadRequestException(
+                    "Filter requires a value for '%s'." % filterObject["field"])
 
-    def _sessionFilterDate(self, filterObject):
-        """Generate Session date filter"""
-        _field = filterObject["field"]
-        _operator = filterObject["operator"]
-        if filterObject["value"]:
-            _value = datetime.strptime(filterObject["value"], "%Y-%m-%d").date()
-        else: 
-            _value = None
-        def aFilter(record):
-            target = getattr(record, _field) or None
-            if ((target in [None, ""]) and (_operator not in ["=", "!="])):
-                return False
-            value = _value
-            return eval("target %s value" % _operator)
+            formatted_filters.append(filterObject)
 
-        return aFilter
+        return formatted_filters
 
 
     @endpoints.method(CONF_SESS_QUERY_REQ, SessionListResponse,
@@ -1069,8 +1887,45 @@ class ConferenceApi(remote.Service):
         name='queryConferenceSessions')
     def queryConferenceSessions(self, request):
         """Query for Sessions within a conference"""
-        session_list = self._getConferenceSessionQuery(request)
-        return SessionListResponse(items=[self._copySessionToForm(session) for session in session_list])
+        a_snapshot, rows = self._getConferenceSessionQuery(request)
+        return self._copySnapshotToForms(a_snapshot, rows)
+
+
+    def _getConferenceSessionsInWindow(self, request):
+        """Return (snapshot, rows) of sessions overlapping the window."""
+        try:
+            start_date = predicates.parseDate(request.date)
+            end_date = predicates.parseDate(request.endDate) or start_date
+            start = absoluteMinutes(start_date,
+                predicates.parseTime(request.startTime))
+            end = absoluteMinutes(end_date,
+                predicates.parseTime(request.endTime))
+        except (AttributeError, TypeError, ValueError):
+            raise endpoints.BadRequestException(
+                "Window requires 'date' (YYYY-MM-DD), 'startTime' and "
+                "'endTime' (HH:MM).")
+        if end <= start:
+            raise endpoints.BadRequestException(
+                "Window must end after it starts.")
+
+        a_conference = self._getConference(request.websafeConferenceKey)
+        if not a_conference:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % request.websafeConferenceKey)
+        a_snapshot = getSnapshot(a_conference.key)
+        return (a_snapshot, a_snapshot.overlapping(start, end))
+
+
+    @endpoints.method(CONF_SESS_WINDOW_REQUEST, SessionListResponse,
+        path='conference/{websafeConferenceKey}/session/window',
+        http_method='GET',
+        name='getConferenceSessionsInWindow')
+    def getConferenceSessionsInWindow(self, request):
+        """Given a conference, return sessions running during a date/time
+        window, ordered by start
+        """
+        a_snapshot, rows = self._getConferenceSessionsInWindow(request)
+        return self._copySnapshotToForms(a_snapshot, rows)
 
 
 # - - - SessionType- - - - - - - - - - - - - - - - - - - -
@@ -1106,17 +1961,14 @@ class ConferenceApi(remote.Service):
             raise endpoints.BadRequestException(
                 "Conference session type 'label' field required")
 
-        # check for duplicate
-        if SessionType.query(SessionType.label == request.label).get():
-            raise endpoints.BadRequestException(
-                "Duplicate conference session type 'label'")
-
         # copy request input to  dict
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
 
-        # create session
+        # create session type, claiming its label; checks for duplicate
+        data['id'] = SessionType.allocate_ids(size=1)[0]
         a_session_type = SessionType(**data)
-        a_session_type.put()
+        self._putUnique(a_session_type,
+            "Duplicate conference session type 'label'")
         return self._copySessionTypeToForm(a_session_type)
 
 
@@ -1139,7 +1991,11 @@ class ConferenceApi(remote.Service):
         except Exception as e:
             raise endpoints.NotFoundException('%s: %s' % (e.__class__.__name__, e))
 
-        a_session_type.key.delete()
+        @ndb.transactional(xg=True)
+        def _destroy():
+            a_session_type.key.delete()
+            unique.release('SessionType', a_session_type.label, a_session_type.key)
+        _destroy()
 
         return self._copySessionTypeToForm(a_session_type)
 
@@ -1174,11 +2030,10 @@ class ConferenceApi(remote.Service):
     def _getConferenceSessionsByType(self, request):
         """Get list of sessions by type for the given conference"""
         a_conference = self._getConference(request.websafeConferenceKey)
-        a_type = request.typeOfSession
-        a_query = Session.query(ancestor=a_conference.key)
-        session_list = a_query.filter(Session.typeOfSession == a_type)
-        return SessionListResponse(
-            items=[self._copySessionToForm(session) for session in session_list])
+        a_snapshot = getSnapshot(a_conference.key)
+        rows = a_snapshot.select([{"field": "typeOfSession", "operator": "=",
+                                   "value": request.typeOfSession}])
+        return self._copySnapshotToForms(a_snapshot, rows)
 
 
     @endpoints.method(SESS_BY_TYPE_REQUEST, SessionListResponse,
@@ -1195,39 +2050,107 @@ class ConferenceApi(remote.Service):
     def _getSessionsInWishlist(self, request):
         """List user wishlist session objects, return SessionListResponse"""
         profile = self._getProfileFromUser()
-        session_key_list = [ndb.Key(urlsafe=session.websafeKey) for session in profile.sessionWishlist]
         wsck = getattr(request, 'websafeConferenceKey')
-
+        conference_key = None
         if wsck:
             a_conference = self._getConference(wsck)
-
-            session_list = Session.query(
-                Session.key.IN(session_key_list),
-                ancestor=a_conference.key)
-                # ancestor=wsck) # also works
-        else:
-            session_list = ndb.get_multi(session_key_list)
+            if not a_conference:
+                raise endpoints.NotFoundException(
+                    'No conference found with key: %s' % wsck)
+            conference_key = a_conference.key
+        session_key_list = self._getWishlistKeys(profile, conference_key)
+
+        # sessions deleted since they were wishlisted are skipped; those
+        # without a date or start time come last
+        session_list = sorted(
+            (session for session in ndb.get_multi(session_key_list) if session),
+            key=lambda s: (s.date is None, s.date, s.startTime is None, s.startTime))
 
         return SessionListResponse(items=[self._copySessionToForm(session) for session in session_list])
 
 
+    def _getWishlistConflicts(self, request):
+        """List overlapping pairs of user wishlist sessions, return
+        SessionConflictListResponse
+        """
+        profile = self._getProfileFromUser()
+        wsck = getattr(request, 'websafeConferenceKey')
+        conference_key = None
+        if wsck:
+            a_conference = self._getConference(wsck)
+            if not a_conference:
+                raise endpoints.NotFoundException(
+                    'No conference found with key: %s' % wsck)
+            conference_key = a_conference.key
+        session_key_list = self._getWishlistKeys(profile, conference_key)
+
+        # sessions without a duration take no time
+        intervals = []
+        for a_session in ndb.get_multi(session_key_list):
+            interval = a_session and sessionInterval(a_session)
+            if interval:
+                intervals.append(interval + (a_session,))
+
+        items = []
+        for first, second in overlappingPairs(intervals):
+            (first_start, first_end), (second_start, second_end) = \
+                sessionInterval(first), sessionInterval(second)
+            items.append(SessionConflictResponse(
+                first=self._copySessionLinkToForm(first),
+                second=self._copySessionLinkToForm(second),
+                minutes=min(first_end, second_end) - max(first_start, second_start)))
+        return SessionConflictListResponse(items=items)
+
+
+    def _migrateWishlist(self, profile):
+        """Move a profile's legacy sessionWishlist to WishlistItem entities."""
+        if not profile.sessionWishlist:
+            return
+
+        @ndb.transactional()
+        def _migrate():
+            prof = profile.key.get()
+            items = []
+            for link in prof.sessionWishlist:
+                session_key = ndb.Key(urlsafe=link.websafeKey)
+                items.append(WishlistItem(id=link.websafeKey, parent=prof.key,
+                    session=session_key, conference=session_key.parent()))
+            prof.sessionWishlist = []
+            ndb.put_multi(items + [prof])
+
+        _migrate()
+        profile.sessionWishlist = []
+
+
+    def _getWishlistKeys(self, profile, conference_key=None):
+        """Return the session keys in a user wishlist, only those of the
+        conference if conference_key is given.
+        """
+        self._migrateWishlist(profile)
+        q = WishlistItem.query(ancestor=profile.key)
+        if conference_key:
+            q = q.filter(WishlistItem.conference == conference_key)
+        return [ndb.Key(urlsafe=key.id()) for key in q.iter(keys_only=True)]
+
+
     def _addSessionToWishlist(self, request):
         """Add session to user wishlist"""
         # get user profile
         profile = self._getProfileFromUser()
         a_session = self._getSession(request.websafeSessionKey)
+        self._migrateWishlist(profile)
+        item_key = ndb.Key(WishlistItem, a_session.key.urlsafe(), parent=profile.key)
 
-        a_session_link = SessionLink(
-            name=a_session.name,
-            websafeKey=a_session.key.urlsafe()
-            )
-
-        if a_session_link in profile.sessionWishlist:
-            raise ConflictException(
-                "Session already in wishlist")
+        # the Profile itself is not rewritten
+        @ndb.transactional()
+        def _add():
+            if item_key.get():
+                raise ConflictException(
+                    "Session already in wishlist")
+            WishlistItem(key=item_key, session=a_session.key,
+                conference=a_session.key.parent()).put()
 
-        profile.sessionWishlist.append(a_session_link)
-        profile.put()
+        _add()
         return BooleanMessage(data=True)
 
 
@@ -1237,18 +2160,14 @@ class ConferenceApi(remote.Service):
         profile = self._getProfileFromUser()
         # validate Key
         a_session = self._getSession(request.websafeSessionKey)
+        self._migrateWishlist(profile)
+        item_key = ndb.Key(WishlistItem, a_session.key.urlsafe(), parent=profile.key)
 
-        a_session_link = SessionLink(
-            name=a_session.name,
-            websafeKey=a_session.key.urlsafe()
-            )
-
-        if a_session_link not in profile.sessionWishlist:
+        if not item_key.get():
             raise ConflictException(
                 "Session not in wishlist")
 
-        profile.sessionWishlist.remove(a_session_link)
-        profile.put()
+        item_key.delete()
         return BooleanMessage(data=True)
 
 
@@ -1261,6 +2180,15 @@ class ConferenceApi(remote.Service):
         return self._getSessionsInWishlist(request)
 
 
+    @endpoints.method(ConferenceSessionWishlistRequest, SessionConflictListResponse,
+        path='conference/session/wishlist/conflicts',
+        http_method='POST',
+        name='getWishlistConflicts')
+    def getWishlistConflicts(self, request):
+        """Get pairs of overlapping sessions in user wishlist"""
+        return self._getWishlistConflicts(request)
+
+
     @endpoints.method(SESS_WISH_STORE_REQUEST, BooleanMessage,
         path='conference/session/{websafeSessionKey}/wishlist',
         http_method='POST',
@@ -1319,7 +2247,8 @@ class ConferenceApi(remote.Service):
             in request.all_fields()
             }
 
-        a_speaker = Speaker(**data)
+        # a new speaker has no sessions to schedule
+        a_speaker = Speaker(scheduleBuilt=True, **data)
         a_speaker.put()
         return self._copySpeakerToForm(a_speaker)
 
@@ -1334,6 +2263,7 @@ class ConferenceApi(remote.Service):
         """Update speaker object, return SpeakerResponse"""
         user = self._getUser()
         speaker = self._getSpeaker(request.websafeSpeakerKey)
+        old_name = speaker.name
         for field in request.all_fields():
             data = getattr(request, field.name)
             if data == "":
@@ -1341,8 +2271,9 @@ class ConferenceApi(remote.Service):
             elif data not in (None, []):
                 setattr(speaker, field.name, data)
         speaker.put()
-        # TODO: update areas with speakerLinks
-        # update session speakers
+        # sessions and conferences link to the speaker by name
+        if speaker.name != old_name:
+            propagation.schedule(speaker.key)
         return self._copySpeakerToForm(speaker)
 
 
@@ -1410,16 +2341,15 @@ class ConferenceApi(remote.Service):
 
         if ws_conference_key:
             a_conference = self._getConference(ws_conference_key)
-
-            session_list = Session.query(ancestor=a_conference.key).fetch()
-            speaker_set = set()
-            for session in session_list:
-                speakers = [ndb.Key(urlsafe=speaker.websafeKey) for speaker in session.speakers]
-                speaker_set.update(speakers)
-
-            speaker_list = []
-            if len(speaker_set):
-                speaker_list = ndb.get_multi(list(speaker_set))
+            if not a_conference:
+                raise endpoints.NotFoundException(
+                    'No conference found with key: %s' % ws_conference_key)
+
+            # Conference.speakers lists the speakers with sessions
+            a_conference = self._getCountedConference(a_conference.key)
+            speaker_list = [speaker for speaker in ndb.get_multi(
+                    [ndb.Key(urlsafe=link.websafeKey) for link in a_conference.speakers])
+                if speaker]
         else:
             speaker_list = Speaker.query().fetch()
 
@@ -1438,6 +2368,59 @@ class ConferenceApi(remote.Service):
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
+    @staticmethod
+    def _recountConferenceSpeakers(a_conference):
+        """Count the sessions of each speaker of a conference stored before
+        Conference.speakers was kept; an ancestor query, so it can run in a
+        transaction on the conference group.
+        """
+        counts = {}
+        for session in Session.query(ancestor=a_conference.key):
+            for link in session.speakers:
+                name, count = counts.get(link.websafeKey, (link.name, 0))
+                counts[link.websafeKey] = (name, count + 1)
+        a_conference.speakers = [SpeakerLink(name=name, numberOfSessions=count,
+                websafeKey=wssk) for wssk, (name, count) in counts.items()]
+        a_conference.speakersCounted = True
+
+
+    def _addConferenceSpeakers(self, a_conference, links, delta=1):
+        """Add delta to the session count of each speaker linked by links
+        (SpeakerLink) in Conference.speakers, in a transaction on the
+        conference group; the caller puts the conference.
+        """
+        if not a_conference.speakersCounted:
+            self._recountConferenceSpeakers(a_conference)
+        counted = dict((link.websafeKey, link) for link in a_conference.speakers)
+        for link in links:
+            if link.websafeKey not in counted:
+                counted[link.websafeKey] = SpeakerLink(
+                    websafeKey=link.websafeKey, numberOfSessions=0)
+                a_conference.speakers.append(counted[link.websafeKey])
+            counted[link.websafeKey].name = link.name
+            counted[link.websafeKey].numberOfSessions += delta
+        a_conference.speakers = [link for link in a_conference.speakers
+            if link.numberOfSessions > 0]
+
+
+    @staticmethod
+    def _getCountedConference(conference_key):
+        """Return the Conference, counting its speakers first if needed."""
+        a_conference = conference_key.get()
+        if a_conference and not a_conference.speakersCounted:
+            @ndb.transactional()
+            def _count():
+                a_conference = conference_key.get()
+                if not a_conference.speakersCounted:
+                    ConferenceApi._recountConferenceSpeakers(a_conference)
+                    a_conference.put()
+                    ndb.get_context().call_on_commit(
+                        ConferenceApi._bumpConferenceGeneration)
+                return a_conference
+            a_conference = _count()
+        return a_conference
+
+
     @ndb.transactional(xg=True)
     def _addSessionSpeaker(self, request):
         """Add a Session/Speaker relationship"""
@@ -1467,17 +2450,34 @@ class ConferenceApi(remote.Service):
             raise endpoints.BadRequestException(
                 "consistency error - report to admin")
 
+        # check the speaker isn't in another session at the same time
+        slot = schedule.slotFor(session)
+        if slot and request.checkConflicts:
+            clashes = schedule.conflicts(speaker, slot)
+            if clashes:
+                names = dict((link.websafeKey, link.name) for link in speaker.sessions)
+                raise ConflictException(
+                    "Speaker is in another session at that time: %s" % ', '.join(
+                        names.get(other.websafeKey, other.websafeKey)
+                        for other in clashes))
+        if slot:
+            schedule.addSlot(speaker, slot)
+
         session.speakers.append(a_speaker_link)
         speaker.sessions.append(a_session_link)
+        # the conference shares the session's entity group
+        a_conference = session.key.parent().get()
+        self._addConferenceSpeakers(a_conference, [a_speaker_link])
 
-        ndb.put_multi([session, speaker])
+        ndb.put_multi([session, speaker, a_conference])
+        ndb.get_context().call_on_commit(lambda: refreshSnapshot(session.key.parent()))
+        ndb.get_context().call_on_commit(self._bumpConferenceGeneration)
 
         # self._updateFeaturedSpeaker(session.key.parent(), speaker)
         taskqueue.add(
-            params={
-                'websafeConferenceKey': session.key.parent().urlsafe(),
-                'websafeSpeakerKey': speaker.key.urlsafe()},
-            url='/tasks/update_featured_speaker'
+            params={'websafeConferenceKey': session.key.parent().urlsafe()},
+            url='/tasks/update_featured_speaker',
+            transactional=True
         )
 
         return BooleanMessage(data=True)
@@ -1514,8 +2514,19 @@ class ConferenceApi(remote.Service):
 
         session.speakers.remove(a_speaker_link)
         speaker.sessions.remove(a_session_link)
+        schedule.removeSlot(speaker, a_session_link.websafeKey)
+        a_conference = session.key.parent().get()
+        self._addConferenceSpeakers(a_conference, [a_speaker_link], -1)
 
-        ndb.put_multi([session, speaker])
+        ndb.put_multi([session, speaker, a_conference])
+        ndb.get_context().call_on_commit(lambda: refreshSnapshot(session.key.parent()))
+        ndb.get_context().call_on_commit(self._bumpConferenceGeneration)
+
+        taskqueue.add(
+            params={'websafeConferenceKey': session.key.parent().urlsafe()},
+            url='/tasks/update_featured_speaker',
+            transactional=True
+        )
 
         return BooleanMessage(data=True)
 
@@ -1526,9 +2537,49 @@ class ConferenceApi(remote.Service):
         name='addSessionSpeaker')
     def addSessionSpeaker(self, request):
         """Add Session/Speaker relationship"""
+        self._buildSpeakerSchedule(ndb.Key(urlsafe=request.websafeSpeakerKey))
         return self._addSessionSpeaker(request)
 
 
+    @ndb.transactional()
+    def _buildSpeakerSchedule(self, speaker_key):
+        """Build the schedule of a speaker linked to sessions before
+        speaker schedules were kept.
+        """
+        speaker = speaker_key.get()
+        if not speaker or speaker.scheduleBuilt:
+            return
+        # sessions are in other entity groups
+        sessions = ndb.non_transactional(ndb.get_multi)(
+            [ndb.Key(urlsafe=link.websafeKey) for link in speaker.sessions])
+        schedule.build(speaker, sessions)
+        speaker.put()
+
+
+    def _rescheduleSpeakers(self, a_session):
+        """Move the session's slot in its speakers' schedules, a transaction
+        per chunk of speakers.
+        """
+        speaker_keys = [ndb.Key(urlsafe=link.websafeKey)
+            for link in a_session.speakers]
+        chunk_size = XG_TRANSACTION_GROUPS - 1
+        for i in range(0, len(speaker_keys), chunk_size):
+            self._rescheduleSpeakerChunk(speaker_keys[i:i + chunk_size], a_session)
+
+
+    @ndb.transactional(xg=True)
+    def _rescheduleSpeakerChunk(self, speaker_keys, a_session):
+        """Move the session's slot in the schedules of some of its speakers."""
+        speakers = [speaker for speaker in ndb.get_multi(speaker_keys) if speaker]
+        slot = schedule.slotFor(a_session)
+        for speaker in speakers:
+            if slot:
+                schedule.addSlot(speaker, slot)
+            else:
+                schedule.removeSlot(speaker, a_session.key.urlsafe())
+        ndb.put_multi(speakers)
+
+
     @endpoints.method(SESS_SPEAK_DELETE_REQ, BooleanMessage,
         path='session/speaker',
         http_method='DELETE',
@@ -1546,11 +2597,34 @@ class ConferenceApi(remote.Service):
             raise endpoints.BadRequestException(
                 "Pass one of 'name' or 'websafeSessionKey' exclusively")
 
-        session_list = Session.query(Session.speakers ==
-            SpeakerLink(
-                name = a_name,
-                websafeKey = a_ws_speaker_key)
-            )
+        if a_ws_speaker_key:
+            speaker = self._getSpeaker(a_ws_speaker_key)
+            speaker_keys = [speaker.key] if speaker else []
+        else:
+            # speakers sharing the name
+            speaker_keys = Speaker.query(
+                Speaker.nameIndex == normalizeName(a_name)).fetch(keys_only=True)
+
+        ancestor = None
+        if request.websafeConferenceKey:
+            a_conference = self._getConference(request.websafeConferenceKey)
+            if not a_conference:
+                raise endpoints.NotFoundException(
+                    'No conference found with key: %s' % request.websafeConferenceKey)
+            ancestor = a_conference.key
+
+        # keys only queries on the speaker key index, then one batched get
+        futures = [Session.query(Session.speakerKeys == speaker_key,
+                ancestor=ancestor).fetch_async(keys_only=True)
+            for speaker_key in speaker_keys]
+        session_keys = []
+        seen = set()
+        for future in futures:
+            for key in future.get_result():
+                if key not in seen:
+                    seen.add(key)
+                    session_keys.append(key)
+        session_list = [session for session in ndb.get_multi(session_keys) if session]
 
         return SessionListResponse(
             items=[self._copySessionToForm(session) for session in session_list])
@@ -1561,7 +2635,7 @@ class ConferenceApi(remote.Service):
         http_method='GET',
         name='getSessionsBySpeaker')
     def getSessionsBySpeaker(self, request):
-        """Get list of sessions by speaker across all conferences"""
+        """Get list of sessions by speaker across all conferences, or in one"""
         return self._getSessionsBySpeaker(request)
 
 
@@ -1587,16 +2661,89 @@ class ConferenceApi(remote.Service):
     #         memcache.set(MEMCACHE_FEATURED_SPEAKER_KEY, speaker)
 
 
-    @endpoints.method(message_types.VoidMessage, SpeakerResponse,
+    @endpoints.method(CONF_FEATURED_SPEAKER_REQUEST, SpeakerResponse,
         path='featured_speakers',
         http_method='GET',
         name='getFeaturedSpeaker')
     def getFeaturedSpeaker(self, request):
-        """Return list of featured speakers"""
-        speaker = memcache.get(MEMCACHE_FEATURED_SPEAKER_KEY)
+        """Return the top featured speaker of a conference; deprecated in
+        favour of getFeaturedSpeakers
+        """
+        if not request.websafeConferenceKey:
+            return SpeakerResponse()
+        ranked = self._getRankedSpeakers(request.websafeConferenceKey)
+        if not ranked or ranked[0][2] < FEATURED_SPEAKER_MIN_SESSIONS:
+            return SpeakerResponse()
+        speaker = ndb.Key(urlsafe=ranked[0][0]).get()
         if not speaker:
             return SpeakerResponse()
         return self._copySpeakerToForm(speaker)
 
 
+    @staticmethod
+    def _rankSpeakers(counts):
+        """Return [(websafeKey, name, numberOfSessions)] from counts, a dict
+        of websafeKey to (name, numberOfSessions), most sessions first.
+        """
+        return sorted(
+            ((wssk, name, count) for wssk, (name, count) in counts.items()
+                if count > 0),
+            key=lambda speaker: (-speaker[2], speaker[1]))
+
+
+    @staticmethod
+    def _countConferenceSpeakers(conference_key):
+        """Return the session counts of the conference's speakers ranked."""
+        a_conference = ConferenceApi._getCountedConference(conference_key)
+        if not a_conference:
+            return []
+        return ConferenceApi._rankSpeakers(dict(
+            (link.websafeKey, (link.name, link.numberOfSessions))
+            for link in a_conference.speakers))
+
+
+    @staticmethod
+    def _updateFeaturedSpeakers(websafeConferenceKey):
+        """Recount the conference's featured speakers into memcache; return
+        them ranked. Used by the update_featured_speaker task.
+        """
+        # Conference.speakers is updated in the transaction queuing the
+        # task, so a retried or late task still caches the current counts
+        ranked = ConferenceApi._countConferenceSpeakers(
+            ndb.Key(urlsafe=websafeConferenceKey))
+        memcache.set(MEMCACHE_FEATURED_SPEAKERS_TPL % websafeConferenceKey, ranked)
+        return ranked
+
+
+    def _getRankedSpeakers(self, wsck):
+        """Return the conference's speakers ranked, from memcache if cached."""
+        ranked = memcache.get(MEMCACHE_FEATURED_SPEAKERS_TPL % wsck)
+        if ranked is None:
+            a_conference = self._getConference(wsck)
+            if not a_conference:
+                raise endpoints.NotFoundException(
+                    'No conference found with key: %s' % wsck)
+            ranked = self._countConferenceSpeakers(a_conference.key)
+            memcache.add(MEMCACHE_FEATURED_SPEAKERS_TPL % wsck, ranked)
+        return ranked
+
+
+    @endpoints.method(CONF_FEATURED_SPEAKERS_REQUEST, SpeakerLinkListResponse,
+        path='conference/{websafeConferenceKey}/featured_speakers',
+        http_method='GET',
+        name='getFeaturedSpeakers')
+    def getFeaturedSpeakers(self, request):
+        """Return the featured speakers of a conference, most sessions first"""
+        wsck = request.websafeConferenceKey
+        limit = request.limit or FEATURED_SPEAKERS_LIMIT
+        if limit < 1:
+            raise endpoints.BadRequestException("'limit' must be positive")
+
+        ranked = self._getRankedSpeakers(wsck)
+        return SpeakerLinkListResponse(items=[
+            SpeakerLinkResponse(websafeKey=wssk, name=name, numberOfSessions=count)
+            for wssk, name, count in ranked[:limit]
+            if count >= FEATURED_SPEAKER_MIN_SESSIONS])
+
+
 api = endpoints.api_server([ConferenceApi]) # register API
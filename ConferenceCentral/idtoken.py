@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+"""idtoken.py
+
+Udacity conference server-side Python App Engine local verification of
+Google ID tokens
+
+An ID token is a JWT signed with one of Google's rotating RSA keys. It is
+verified here against the published signing keys, which are cached in
+memcache and refreshed by cron, so resolving a new ID token needs no
+tokeninfo call.
+
+"""
+
+import base64
+import json
+import logging
+import re
+import time
+
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import RSA
+from Crypto.Signature import PKCS1_v1_5
+
+from google.appengine.api import memcache
+from google.appengine.api import urlfetch
+
+from settings import ANDROID_AUDIENCE
+from settings import GOOGLE_CERTS_URL
+from settings import WEB_CLIENT_ID
+
+MEMCACHE_CERTS_KEY = "ID_TOKEN_CERTS"
+# seconds the signing keys are cached when the response sets no max-age
+CERTS_CACHE_TIME = 3600
+CERTS_DEADLINE = 5 # seconds
+ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+AUDIENCES = (WEB_CLIENT_ID, ANDROID_AUDIENCE)
+CLOCK_SKEW = 300 # seconds
+
+# (certs, {kid: RSA key}) of the certs last read from memcache
+_local = (None, {})
+
+
+class InvalidToken(Exception):
+    """InvalidToken -- ID token failing verification"""
+    pass
+
+
+def _b64decode(segment):
+    segment = str(segment)
+    return base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4))
+
+
+def _toLong(segment):
+    return long(_b64decode(segment).encode('hex'), 16)
+
+
+def fetchCerts():
+    """Fetch Google's signing keys and cache them in memcache; return them
+    as {kid: (n, e)}, None if they can't be fetched.
+    """
+    try:
+        resp = urlfetch.fetch(GOOGLE_CERTS_URL, deadline=CERTS_DEADLINE)
+    except urlfetch.Error as e:
+        logging.warning('idtoken: fetching signing keys failed: %s', e)
+        return None
+    if resp.status_code != 200:
+        logging.warning('idtoken: fetching signing keys returned %d',
+            resp.status_code)
+        return None
+
+    certs = dict((key['kid'], (key['n'], key['e']))
+        for key in json.loads(resp.content).get('keys', [])
+        if key.get('kty') == 'RSA')
+    match = re.search(r'max-age=(\d+)', resp.headers.get('cache-control', ''))
+    memcache.set(MEMCACHE_CERTS_KEY, certs,
+        time=int(match.group(1)) if match else CERTS_CACHE_TIME)
+    return certs
+
+
+def _getKeys():
+    """Return the signing keys by kid, parsed once per set of certs."""
+    global _local
+    certs = memcache.get(MEMCACHE_CERTS_KEY)
+    if certs is None:
+        certs = fetchCerts() or {}
+    local = _local
+    if local[0] != certs:
+        local = (certs, dict((kid, RSA.construct((_toLong(n), _toLong(e))))
+            for kid, (n, e) in certs.items()))
+        _local = local
+    return local[1]
+
+
+def verify(token):
+    """Return the claims of a Google ID token verified locally; None if
+    token is not a JWT or its signing key is unknown, so it can only be
+    checked remotely. Raises InvalidToken if the token is not valid.
+    """
+    segments = str(token).split('.')
+    if len(segments) != 3:
+        return None
+    try:
+        header = json.loads(_b64decode(segments[0]))
+        claims = json.loads(_b64decode(segments[1]))
+        signature = _b64decode(segments[2])
+    except (TypeError, ValueError):
+        return None
+
+    if header.get('alg') != 'RS256':
+        raise InvalidToken('Unsupported algorithm: %s' % header.get('alg'))
+    key = _getKeys().get(header.get('kid'))
+    if key is None:
+        return None
+    digest = SHA256.new('%s.%s' % (segments[0], segments[1]))
+    if not PKCS1_v1_5.new(key).verify(digest, signature):
+        raise InvalidToken('Invalid signature')
+
+    if claims.get('iss') not in ISSUERS:
+        raise InvalidToken('Invalid issuer: %s' % claims.get('iss'))
+    if claims.get('aud') not in AUDIENCES:
+        raise InvalidToken('Invalid audience: %s' % claims.get('aud'))
+    now = time.time()
+    try:
+        expires = float(claims['exp'])
+        issued = float(claims.get('iat', 0))
+    except (KeyError, TypeError, ValueError):
+        raise InvalidToken('Invalid expiry')
+    if expires + CLOCK_SKEW < now:
+        raise InvalidToken('Token expired')
+    if issued > now + CLOCK_SKEW:
+        raise InvalidToken('Token issued in the future')
+    if not claims.get('sub'):
+        raise InvalidToken('No subject')
+    return claims
@@ -15,11 +15,12 @@ __author__ = 'wesc+api@google.com (Wesley Chun)'
 import webapp2
 from google.appengine.api import app_identity
 from google.appengine.api import mail
-from google.appengine.api import memcache
-from google.appengine.ext import ndb
+from google.appengine.api import taskqueue
+import admission
+import idtoken
 from conference import ConferenceApi
-from conference import MEMCACHE_FEATURED_SPEAKER_KEY
-from models import Session
+from conference import REINDEXED_KINDS
+from conference import UNIQUE_FIELDS
 
 
 
@@ -30,6 +31,13 @@ class SetAnnouncementHandler(webapp2.RequestHandler):
         self.response.set_status(204)
 
 
+class RefreshIdTokenCertsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Refresh the cached ID token signing keys (cron)."""
+        if idtoken.fetchCerts() is None:
+            self.response.set_status(503)
+
+
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
     def post(self):
         """Send email confirming Conference creation."""
@@ -43,23 +51,94 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
                 'conferenceInfo')
         )
 
-class UpdateFeaturedSpeakerHandler(webapp2.RequestHandler):
+class PropagateHandler(webapp2.RequestHandler):
+    def post(self):
+        """Propagate a renamed or deleted entity to a batch of its links."""
+        step = self.request.get('step')
+        websafe_key = self.request.get('websafeKey')
+        cursor = ConferenceApi._propagate(
+            step, websafe_key, self.request.get('cursor') or None)
+        if cursor:
+            # continue with the next batch
+            taskqueue.add(
+                params={'step': step, 'websafeKey': websafe_key, 'cursor': cursor},
+                url='/tasks/propagate'
+            )
+
+
+class BackfillUniqueValuesHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start the backfill of every unique kind (admin, after deploying)."""
+        for kind in UNIQUE_FIELDS:
+            taskqueue.add(params={'kind': kind},
+                url='/tasks/backfill_unique_values'
+            )
+
+    def post(self):
+        """Claim unique names of a batch of entities stored without markers."""
+        kind = self.request.get('kind')
+        cursor = ConferenceApi._backfillUniqueValues(
+            kind, self.request.get('cursor') or None)
+        if cursor:
+            # continue with the next batch
+            taskqueue.add(params={'kind': kind, 'cursor': cursor},
+                url='/tasks/backfill_unique_values'
+            )
+
+
+class ReindexEntitiesHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start reindexing every reindexed kind (admin, after deploying)."""
+        for kind in REINDEXED_KINDS:
+            taskqueue.add(params={'kind': kind},
+                url='/tasks/reindex_entities'
+            )
+
+    def post(self):
+        """Put a batch of entities again to write new indexes."""
+        kind = self.request.get('kind')
+        cursor = ConferenceApi._reindexEntities(
+            kind, self.request.get('cursor') or None)
+        if cursor:
+            # continue with the next batch
+            taskqueue.add(params={'kind': kind, 'cursor': cursor},
+                url='/tasks/reindex_entities'
+            )
+
+
+class ReconcileSeatsHandler(webapp2.RequestHandler):
     def post(self):
-        """Update featured speaker"""
-        conference_key = ndb.Key(urlsafe=self.request.get('websafeConferenceKey'))
-        wsk_speaker = self.request.get('websafeSpeakerKey')
+        """Update conference seatsAvailable from its seat shards."""
+        ConferenceApi._reconcileSeats(self.request.get('websafeConferenceKey'))
 
-        session_list = Session.query(
-            Session.speakers.websafeKey==wsk_speaker,
-            ancestor=conference_key).fetch()
 
-        if len(session_list) > 1:
-            speaker = ndb.Key(urlsafe=wsk_speaker).get()
-            memcache.set(MEMCACHE_FEATURED_SPEAKER_KEY, speaker)
+class DrainRegistrationsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Admit queued registrations (cron)."""
+        self.post()
+
+    def post(self):
+        """Admit queued registrations in batches."""
+        if ConferenceApi._drainRegistrations():
+            # more waiting
+            admission.scheduleDrain()
+
+
+class UpdateFeaturedSpeakerHandler(webapp2.RequestHandler):
+    def post(self):
+        """Update featured speakers of a conference"""
+        ConferenceApi._updateFeaturedSpeakers(
+            self.request.get('websafeConferenceKey'))
 
 
 app = webapp2.WSGIApplication([
     ('/crons/set_announcement', SetAnnouncementHandler),
+    ('/crons/refresh_id_token_certs', RefreshIdTokenCertsHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
     ('/tasks/update_featured_speaker', UpdateFeaturedSpeakerHandler),
+    ('/tasks/propagate', PropagateHandler),
+    ('/tasks/reconcile_seats', ReconcileSeatsHandler),
+    ('/tasks/backfill_unique_values', BackfillUniqueValuesHandler),
+    ('/tasks/reindex_entities', ReindexEntitiesHandler),
+    ('/tasks/drain_registrations', DrainRegistrationsHandler),
 ], debug=True)
@@ -20,6 +20,10 @@ import datetime
 from protorpc import messages
 from google.appengine.ext import ndb
 
+def normalizeName(value):
+    """Return a name case folded, with whitespace runs collapsed."""
+    return u' '.join(value.split()).lower()
+
 class ConflictException(endpoints.ServiceException):
     """ConflictException -- exception mapped to HTTP 409 response"""
     http_status = httplib.CONFLICT
@@ -57,13 +61,25 @@ class SpeakerLinkResponse(messages.Message):
     numberOfSessions = messages.IntegerField(2)
     websafeKey = messages.StringField(3)
 
+class SpeakerLinkListResponse(messages.Message):
+    """SpeakerLinkListResponse -- multiple SpeakerLink outbound form message"""
+    items = messages.MessageField(SpeakerLinkResponse, 1, repeated=True)
+
 class Profile(ndb.Model):
     """Profile -- User profile object"""
     displayName     = ndb.StringProperty()
     mainEmail       = ndb.StringProperty()
     teeShirtSize    = ndb.StringProperty(default='NOT_SPECIFIED')
     conferenceKeysToAttend = ndb.StringProperty(repeated=True)
-    sessionWishlist = ndb.StructuredProperty(SessionLink, repeated=True)
+    sessionWishlist = ndb.StructuredProperty(SessionLink, repeated=True) # legacy; see WishlistItem
+
+class WishlistItem(ndb.Model):
+    """WishlistItem -- session in a user wishlist; child of Profile, keyed by
+    the session websafeKey
+    """
+    session    = ndb.KeyProperty(kind='Session', required=True)
+    conference = ndb.KeyProperty(kind='Conference', required=True)
+    created    = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
 
 class ProfileMiniForm(messages.Message):
     """ProfileMiniForm -- update Profile form message"""
@@ -91,15 +107,39 @@ class Conference(ndb.Model):
     name            = ndb.StringProperty(required=True)
     description     = ndb.StringProperty()
     organizerUserId = ndb.StringProperty()
+    organizerDisplayName = ndb.StringProperty(indexed=False) # copy of Profile.displayName
     topics          = ndb.StringProperty(repeated=True)
     city            = ndb.StringProperty()
     startDate       = ndb.DateProperty()
     month           = ndb.IntegerProperty() # TODO: do we need for indexing like Java?
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
-    seatsAvailable  = ndb.IntegerProperty()
+    seatsAvailable  = ndb.IntegerProperty() # summary of the seat shards
+    seatShards      = ndb.IntegerProperty(default=0)
+    registrationQueued = ndb.BooleanProperty(default=False) # admission mode
     sessions        = ndb.StringProperty(repeated=True)
-    speakers        = ndb.StructuredProperty(SpeakerLink, repeated=True)
+    speakers        = ndb.StructuredProperty(SpeakerLink, repeated=True) # session counts
+    speakersCounted = ndb.BooleanProperty(default=False, indexed=False)
+
+class Announcement(ndb.Model):
+    """Announcement -- conferences that are nearly sold out; a singleton
+    kept up to date as conferences cross the threshold
+    """
+    conferences = ndb.StructuredProperty(ConferenceLink, repeated=True)
+
+class SeatShard(ndb.Model):
+    """SeatShard -- share of a conference's available seats; a root entity
+    so that registrations are spread over entity groups
+    """
+    conference     = ndb.KeyProperty(kind=Conference, required=True)
+    seatsAvailable = ndb.IntegerProperty(default=0, indexed=False)
+
+class Reservation(ndb.Model):
+    """Reservation -- outcome of a queued registration; child of Conference,
+    keyed by user id
+    """
+    status  = ndb.StringProperty(required=True, choices=('CONFIRMED', 'REJECTED'))
+    created = ndb.DateTimeProperty(auto_now_add=True)
 
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
@@ -117,10 +157,16 @@ class ConferenceForm(messages.Message):
     organizerDisplayName = messages.StringField(12)
     sessions        = messages.StringField(13, repeated=True)
     speakers        = messages.StringField(14, repeated=True)
+    registrationQueued = messages.BooleanField(15)
 
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+class ConferenceBatchRequest(messages.Message):
+    """ConferenceBatchRequest -- multiple Conference inbound form message"""
+    items = messages.MessageField(ConferenceForm, 1, repeated=True)
 
 class TeeShirtSize(messages.Enum):
     """TeeShirtSize -- t-shirt size enumeration value"""
@@ -140,6 +186,18 @@ class TeeShirtSize(messages.Enum):
     XXXL_M = 14
     XXXL_W = 15
 
+class RegistrationStatus(messages.Enum):
+    """RegistrationStatus -- registration status enumeration value"""
+    NONE = 1
+    PENDING = 2
+    CONFIRMED = 3
+    REJECTED = 4
+
+class RegistrationStatusForm(messages.Message):
+    """RegistrationStatusForm -- registration status outbound form message"""
+    websafeConferenceKey = messages.StringField(1)
+    status = messages.EnumField('RegistrationStatus', 2)
+
 class ConferenceQueryForm(messages.Message):
     """ConferenceQueryForm -- Conference query inbound form message"""
     field = messages.StringField(1)
@@ -149,6 +207,8 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2)
+    pageToken = messages.StringField(3)
 
 
 ###############################################################################
@@ -170,8 +230,11 @@ class Session(ndb.Model):
     #             else None)
     endTime       = ndb.TimeProperty(default=None)
     speakers      = ndb.StructuredProperty(SpeakerLink, repeated=True) # Speaker name
+    speakerKeys   = ndb.KeyProperty(kind='Speaker', repeated=True) # from speakers
 
     def _pre_put_hook(self):
+        self.speakerKeys = [ndb.Key(urlsafe=link.websafeKey)
+            for link in self.speakers if link.websafeKey]
         if (self.startTime and self.duration):
             self.endTime = (datetime.datetime.combine(datetime.date(1970,1,1), self.startTime) + datetime.timedelta(minutes=self.duration)).time()
         else:
@@ -194,6 +257,14 @@ class SessionListResponse(messages.Message):
     """SessionListResponse -- multiple Session outbound form message"""
     items = messages.MessageField(SessionResponse, 1, repeated=True)
 
+class SessionBatchRequest(messages.Message):
+    """SessionBatchRequest -- multiple Session inbound form message; items,
+    or csv with a header row naming SessionResponse fields and a speakers
+    column of speaker keys separated by ';'
+    """
+    items = messages.MessageField(SessionResponse, 1, repeated=True)
+    csv   = messages.StringField(2)
+
 
 class SessionQueryFilter(messages.Message):
     """SessionQueryFilter -- Session query filter form"""
@@ -212,6 +283,12 @@ class SessionQueryRequest(messages.Message):
 # SessionType object
 #
 
+class UniqueValue(ndb.Model):
+    """UniqueValue -- marker claiming a normalized name for one entity;
+    keyed by "<kind>:<normalized name>"
+    """
+    target = ndb.KeyProperty(required=True)
+
 class SessionType(ndb.Model):
     """SessionType -- Session type list"""
     label = ndb.StringProperty()
@@ -235,6 +312,20 @@ class SessionTypeListResponse(messages.Message):
 # Wishlist object
 #
 
+class SessionConflictResponse(messages.Message):
+    """SessionConflictResponse -- pair of overlapping sessions outbound form
+    message
+    """
+    first   = messages.MessageField(SessionLinkResponse, 1)
+    second  = messages.MessageField(SessionLinkResponse, 2)
+    minutes = messages.IntegerField(3) # length of the overlap
+
+class SessionConflictListResponse(messages.Message):
+    """SessionConflictListResponse -- multiple SessionConflictResponse
+    outbound form message
+    """
+    items = messages.MessageField(SessionConflictResponse, 1, repeated=True)
+
 class ConferenceSessionWishlistRequest(messages.Message):
     """ConferenceSessionWishlistRequest -- Conference session wishlist request
     form
@@ -247,11 +338,24 @@ class ConferenceSessionWishlistRequest(messages.Message):
 # Speaker object
 #
 
+class SpeakerSlot(ndb.Model):
+    """SpeakerSlot -- time taken by one of a speaker's sessions, in minutes
+    from the start of the calendar
+    """
+    start      = ndb.IntegerProperty(required=True)
+    end        = ndb.IntegerProperty(required=True)
+    websafeKey = ndb.StringProperty(required=True) # Session key
+
 class Speaker(ndb.Model):
     """Speaker -- Conference Speaker object"""
     name        = ndb.StringProperty(required=True)
     description = ndb.StringProperty()
     sessions    = ndb.StructuredProperty(SessionLink, repeated=True) # Session name
+    # slots of the timed sessions, sorted by start; see schedule.py
+    schedule    = ndb.LocalStructuredProperty(SpeakerSlot, repeated=True)
+    scheduleMaxDuration = ndb.IntegerProperty(default=0, indexed=False)
+    scheduleBuilt = ndb.BooleanProperty(default=False, indexed=False)
+    nameIndex   = ndb.ComputedProperty(lambda self: normalizeName(self.name))
 
     # def sessions(self):
     #     return Session.query(self.key.urlsafe().IN(Session.speakers))
@@ -289,4 +393,5 @@ class SpeakerSessionsRequest(messages.Message):
     """SpeakerRequest -- Speaker outbound form message"""
     websafeSpeakerKey = messages.StringField(1)
     name        = messages.StringField(2)
+    websafeConferenceKey = messages.StringField(3)
 
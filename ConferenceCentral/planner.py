@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+"""planner.py
+
+Udacity conference server-side Python App Engine datastore query planner
+
+Decides which filters of a paged query are served by the datastore --
+using the built-in indexes and the composite indexes declared in
+index.yaml -- and which are left to be evaluated in memory. The datastore
+always produces the complete sort order, so that cursors stay meaningful.
+
+"""
+
+import itertools
+import logging
+import os
+
+import yaml
+
+import predicates
+
+INDEX_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'index.yaml')
+
+EQ = predicates.EQ
+NE = predicates.NE
+
+# Selectivity weights used to rank candidate plans: an equality filter
+# usually narrows the candidate set more than a range.
+EQ_WEIGHT = 4
+RANGE_WEIGHT = 2
+
+
+class Index(object):
+    """Index -- composite index declared in index.yaml"""
+
+    def __init__(self, kind, properties):
+        self.kind = kind
+        self.properties = tuple(properties)
+
+    def __repr__(self):
+        return '%s(%s)' % (self.kind, ', '.join(self.properties))
+
+
+class QueryPlan(object):
+    """QueryPlan -- split of a query between the datastore and memory
+
+    filters         filters sent to the datastore
+    orders          sort orders sent to the datastore (the inequality
+                    field, if any, then the requested orders)
+    extraFilters    filters evaluated in memory
+    index           composite Index serving the query; None when built-in
+                    indexes are enough
+    """
+
+    def __init__(self, kind, filters, orders, extraFilters, index=None):
+        self.kind = kind
+        self.filters = filters
+        self.orders = orders
+        self.extraFilters = extraFilters
+        self.index = index
+        self._predicate = None
+
+    def matches(self, entity):
+        """Return True if entity satisfies every in-memory filter."""
+        if self._predicate is None:
+            self._predicate = predicates.compileFilters(self.extraFilters)
+        return self._predicate(entity)
+
+    def __str__(self):
+        def _fmt(filters):
+            return '[%s]' % ', '.join(
+                '%s %s %r' % (f["field"], f["operator"], f["value"]) for f in filters)
+        return 'QueryPlan(%s index=%s datastore=%s orders=%s memory=%s)' % (
+            self.kind, self.index or 'built-in', _fmt(self.filters),
+            list(self.orders), _fmt(self.extraFilters))
+
+
+_indexes = None
+
+
+def loadIndexes(path=INDEX_FILE):
+    """Return the composite indexes declared in index.yaml, by kind."""
+    try:
+        with open(path) as f:
+            config = yaml.safe_load(f) or {}
+    except (IOError, yaml.YAMLError) as e:
+        logging.warning('planner: no indexes loaded from %s: %s', path, e)
+        return {}
+
+    indexes = {}
+    for entry in config.get('indexes') or []:
+        properties = entry.get('properties') or []
+        # the API only issues ascending sort orders, without an ancestor
+        if any(p.get('direction', 'asc') != 'asc' for p in properties):
+            continue
+        if entry.get('ancestor') in (True, 'yes', 'true'):
+            continue
+        indexes.setdefault(entry['kind'], []).append(
+            Index(entry['kind'], [p['name'] for p in properties]))
+    return indexes
+
+
+def getIndexes():
+    """Return the declared indexes, loading index.yaml on first use."""
+    global _indexes
+    if _indexes is None:
+        _indexes = loadIndexes()
+    return _indexes
+
+
+def _findIndex(kind, eqFields, orders):
+    """Return the index serving equality filters on eqFields followed by
+    orders (the inequality field first, if any); None if built-in indexes
+    serve it, False if nothing does.
+    """
+    # built-in: kind and equality-only (merge join) queries
+    if not orders:
+        return None
+    # built-in: single property index, one filter and/or sort on it
+    if not eqFields and len(orders) == 1:
+        return None
+
+    for index in getIndexes().get(kind, []):
+        if len(index.properties) != len(eqFields) + len(orders):
+            continue
+        # equality properties may come in any order before the sort orders
+        if (set(index.properties[:len(eqFields)]) == set(eqFields) and
+                list(index.properties[len(eqFields):]) == list(orders)):
+            return index
+    return False
+
+
+def _weight(f):
+    """Return the selectivity weight of a filter."""
+    if f["operator"] == EQ:
+        return EQ_WEIGHT
+    return RANGE_WEIGHT
+
+
+def _unique(items):
+    """Return items without duplicates, in order of first appearance."""
+    seen = set()
+    return [i for i in items if not (i in seen or seen.add(i))]
+
+
+def plan(kind, filters, orders=()):
+    """Return the QueryPlan for filters (as formatted by the API) and the
+    requested ascending sort orders.
+
+    "!=" filters stay in memory because the datastore serves them as
+    multiple queries, which can't be paged with cursors.
+    """
+    eqFields = _unique(f["field"] for f in filters if f["operator"] == EQ)
+    ineqFields = _unique(f["field"] for f in filters
+        if f["operator"] not in (EQ, NE))
+
+    best = None
+    for ineq in [None] + ineqFields:
+        # a datastore inequality requires its field to be the first sort order
+        if ineq:
+            dsOrders = [ineq] + [o for o in orders if o != ineq]
+        else:
+            dsOrders = list(orders)
+
+        for size in range(len(eqFields), -1, -1):
+            for subset in itertools.combinations(eqFields, size):
+                index = _findIndex(kind, subset, dsOrders)
+                if index is False:
+                    continue
+                pushed = [f for f in filters
+                    if (f["operator"] == EQ and f["field"] in subset) or
+                       (f["operator"] not in (EQ, NE) and f["field"] == ineq)]
+                score = sum(_weight(f) for f in pushed)
+                # prefer the higher score, then the smaller index
+                rank = (score, -len(index.properties) if index else 0)
+                if best is None or rank > best[0]:
+                    best = (rank, pushed, dsOrders, index)
+
+    if best is None:
+        # only when the sort order has no index at all
+        raise ValueError('No index serves %s ordered by %s' % (kind, list(orders)))
+
+    _, pushed, dsOrders, index = best
+    extra = [f for f in filters if not any(f is p for p in pushed)]
+    return QueryPlan(kind, pushed, dsOrders, extra, index)
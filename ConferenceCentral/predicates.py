@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+"""predicates.py
+
+Udacity conference server-side Python App Engine filter predicates
+
+Compiles formatted query filters into a single Python predicate. Values
+are parsed once, operators are mapped to `operator` module functions and
+all filters are combined into one closure, so records are tested without
+generating or evaluating source code.
+
+"""
+
+import operator
+
+from datetime import datetime
+
+STRING = "string"
+INT = "int"
+DATE = "date"
+TIME = "time"
+
+EQ = '='
+NE = '!='
+
+COMPARATORS = {
+    '=':  operator.eq,
+    '!=': operator.ne,
+    '>':  operator.gt,
+    '>=': operator.ge,
+    '<':  operator.lt,
+    '<=': operator.le,
+}
+
+
+def parseDate(value):
+    """Parse YYYY-MM-DD; an empty value means "no date"."""
+    if value in (None, ""):
+        return None
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def parseTime(value):
+    """Parse HH:MM."""
+    return datetime.strptime(value, "%H:%M").time()
+
+
+PARSERS = {
+    STRING: lambda value: value,
+    INT: int,
+    DATE: parseDate,
+    TIME: parseTime,
+}
+
+
+def parseValue(value, type=STRING):
+    """Return the filter value converted to type; raises ValueError."""
+    try:
+        return PARSERS[type](value)
+    except TypeError:
+        raise ValueError('invalid %s value: %r' % (type, value))
+
+
+def _getattr(record, field):
+    return getattr(record, field, None)
+
+
+def compileFilter(field, opsymbol, value, getter=_getattr):
+    """Return a predicate testing getter(record, field) against value.
+
+    Repeated (list) values match if any item does; a missing value never
+    satisfies an ordering comparison.
+    """
+    try:
+        compare = COMPARATORS[opsymbol]
+    except KeyError:
+        raise ValueError('invalid operator: %r' % opsymbol)
+    ordering = opsymbol not in (EQ, NE)
+    if ordering and value is None:
+        raise ValueError("operator '%s' requires a value for %s" % (opsymbol, field))
+
+    def predicate(record):
+        target = getter(record, field)
+        if isinstance(target, list):
+            for item in target:
+                if compare(item, value):
+                    return True
+            return False
+        if target is None and ordering:
+            return False
+        return compare(target, value)
+
+    return predicate
+
+
+def compileFilters(filters, getter=_getattr, convert=None):
+    """Return one predicate that is true when every filter matches.
+
+    filters are dicts with "field", "operator" and (already parsed) "value"
+    items; convert optionally maps a field to a function applied once to
+    its filter value, for records storing fields in another representation.
+    """
+    convert = convert or {}
+    tests = []
+    for f in filters:
+        value = f["value"]
+        if f["field"] in convert and value is not None:
+            value = convert[f["field"]](value)
+        tests.append(compileFilter(f["field"], f["operator"], value, getter))
+
+    if not tests:
+        return lambda record: True
+    if len(tests) == 1:
+        return tests[0]
+
+    def predicate(record):
+        for test in tests:
+            if not test(record):
+                return False
+        return True
+
+    return predicate
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+"""propagation.py
+
+Udacity conference server-side Python App Engine propagation of
+denormalized links
+
+Names are copied into the links other entities keep: SpeakerLink in
+Session.speakers and Conference.speakers, SessionLink in Speaker.sessions,
+and the organiser display name in Conference. Deleted sessions are also
+removed from wishlists. When the source entity is renamed or deleted,
+schedule() queues a propagate task per step. The task walks the referencing
+entities with a cursor and rewrites a batch at a time, one transaction
+per entity group. Each batch re-reads the source, so repeating a batch or
+running tasks out of order is harmless.
+
+"""
+
+from collections import OrderedDict
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Session
+from models import Speaker
+from models import WishlistItem
+
+import schedule as speaker_schedule
+
+BATCH_SIZE = 100
+
+# returned by a step update to delete the entity
+DELETE = 'delete'
+
+
+def _relink(links, websafeKey, source):
+    """Rename the links to websafeKey after source, or drop them if source
+    was deleted; return (links, changed).
+    """
+    if source is None:
+        kept = [link for link in links if link.websafeKey != websafeKey]
+        return kept, len(kept) != len(links)
+    changed = False
+    for link in links:
+        if link.websafeKey == websafeKey and link.name != source.name:
+            link.name = source.name
+            changed = True
+    return links, changed
+
+
+def _sessionSpeakerName(a_session, speaker_key, speaker):
+    a_session.speakers, changed = _relink(
+        a_session.speakers, speaker_key.urlsafe(), speaker)
+    return changed
+
+
+def _conferenceSpeakerName(conf, speaker_key, speaker):
+    conf.speakers, changed = _relink(conf.speakers, speaker_key.urlsafe(), speaker)
+    return changed
+
+
+def _speakerSessionLink(speaker, session_key, a_session):
+    wssk = session_key.urlsafe()
+    speaker.sessions, changed = _relink(speaker.sessions, wssk, a_session)
+    if a_session is None and any(slot.websafeKey == wssk for slot in speaker.schedule):
+        speaker_schedule.removeSlot(speaker, wssk)
+        changed = True
+    return changed
+
+
+def _wishlistSessionLink(item, session_key, a_session):
+    return DELETE if a_session is None else False
+
+
+def _conferenceOrganizerName(conf, profile_key, prof):
+    display_name = getattr(prof, 'displayName', None)
+    if conf.organizerDisplayName == display_name:
+        return False
+    conf.organizerDisplayName = display_name
+    return True
+
+
+class Step(object):
+    """Step -- rewrite of the entities of kind referencing a source"""
+
+    def __init__(self, kind, query, update):
+        self.kind = kind
+        self.query = query      # source key -> query of referencing entities
+        self.update = update    # (entity, source key, source) -> changed or DELETE
+
+
+STEPS = {
+    'session_speaker_name': Step('Session',
+        lambda key: Session.query(Session.speakerKeys == key),
+        _sessionSpeakerName),
+    'conference_speaker_name': Step('Conference',
+        lambda key: Conference.query(Conference.speakers.websafeKey == key.urlsafe()),
+        _conferenceSpeakerName),
+    'speaker_session_link': Step('Speaker',
+        lambda key: Speaker.query(Speaker.sessions.websafeKey == key.urlsafe()),
+        _speakerSessionLink),
+    'wishlist_session_link': Step('WishlistItem',
+        lambda key: WishlistItem.query(WishlistItem.session == key),
+        _wishlistSessionLink),
+    'conference_organizer_name': Step('Conference',
+        lambda key: Conference.query(ancestor=key),
+        _conferenceOrganizerName),
+}
+
+# steps run when an entity of the kind is renamed or deleted
+SOURCE_STEPS = {
+    'Speaker': ('session_speaker_name', 'conference_speaker_name'),
+    'Session': ('speaker_session_link',),
+    'Profile': ('conference_organizer_name',),
+}
+# further steps run only when an entity of the kind is deleted
+DELETE_STEPS = {
+    'Session': ('wishlist_session_link',),
+}
+
+
+def schedule(source_key, deleted=False):
+    """Queue the propagation of a renamed or deleted entity; the tasks are
+    transactional when called in a transaction.
+    """
+    steps = SOURCE_STEPS[source_key.kind()]
+    if deleted:
+        steps += DELETE_STEPS.get(source_key.kind(), ())
+    for step in steps:
+        taskqueue.add(params={'step': step, 'websafeKey': source_key.urlsafe()},
+            url='/tasks/propagate',
+            transactional=ndb.in_transaction()
+        )
+
+
+@ndb.tasklet
+def _updateGroup(step, keys, source_key, source):
+    """Tasklet rewriting the entities of one entity group in a transaction;
+    returns the keys of the changed (or deleted) entities.
+    """
+    @ndb.transactional_tasklet
+    def _update():
+        entities = yield ndb.get_multi_async(keys)
+        changed, deleted = [], []
+        for entity in entities:
+            result = entity and step.update(entity, source_key, source)
+            if result == DELETE:
+                deleted.append(entity.key)
+            elif result:
+                changed.append(entity)
+        yield ndb.put_multi_async(changed), ndb.delete_multi_async(deleted)
+        raise ndb.Return([entity.key for entity in changed] + deleted)
+
+    changed = yield _update()
+    raise ndb.Return(changed)
+
+
+def run(step_name, websafeKey, websafeCursor=None):
+    """Propagate the source to one batch of referencing entities; return
+    (websafe cursor of the next batch or None, keys of changed entities).
+    """
+    step = STEPS[step_name]
+    source_key = ndb.Key(urlsafe=websafeKey)
+    cursor = ndb.Cursor(urlsafe=websafeCursor) if websafeCursor else None
+    keys, next_cursor, more = step.query(source_key).fetch_page(
+        BATCH_SIZE, start_cursor=cursor, keys_only=True)
+
+    # the source as of now; None once deleted
+    source = source_key.get()
+    groups = OrderedDict()
+    for key in keys:
+        groups.setdefault(key.root(), []).append(key)
+    futures = [_updateGroup(step, group_keys, source_key, source)
+        for group_keys in groups.values()]
+    changed = []
+    for future in futures:
+        changed.extend(future.get_result())
+
+    if more and next_cursor:
+        return next_cursor.urlsafe(), changed
+    return None, changed
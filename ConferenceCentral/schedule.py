@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+"""schedule.py
+
+Udacity conference server-side Python App Engine speaker schedules
+
+Each Speaker keeps the time slots of its sessions sorted by start, along
+with the longest slot. A slot overlapping a new session must start before
+the session ends and no more than the longest slot before it starts, so
+a bisect over the starts finds the few candidates without loading any
+Session entity.
+
+"""
+
+from bisect import bisect_left
+
+from models import SpeakerSlot
+
+from snapshot import sessionInterval
+
+
+class _SlotStarts(object):
+    """Sequence view of the slot starts, for bisect."""
+
+    def __init__(self, slots):
+        self.slots = slots
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __getitem__(self, index):
+        return self.slots[index].start
+
+
+def slotFor(a_session):
+    """Return the SpeakerSlot of a Session, None if it isn't timed."""
+    interval = sessionInterval(a_session)
+    if not interval:
+        return None
+    start, end = interval
+    return SpeakerSlot(start=start, end=end, websafeKey=a_session.key.urlsafe())
+
+
+def conflicts(speaker, slot):
+    """Return the speaker's slots overlapping slot, except its own."""
+    starts = _SlotStarts(speaker.schedule)
+    lo = bisect_left(starts, slot.start - speaker.scheduleMaxDuration)
+    hi = bisect_left(starts, max(slot.end, slot.start + 1))
+    return [other for other in speaker.schedule[lo:hi]
+        if other.websafeKey != slot.websafeKey and
+           (other.end > slot.start or other.start >= slot.start)]
+
+
+def removeSlot(speaker, websafeKey):
+    """Remove the slot of the session from the speaker's schedule."""
+    speaker.schedule = [slot for slot in speaker.schedule
+        if slot.websafeKey != websafeKey]
+    speaker.scheduleMaxDuration = max(
+        [slot.end - slot.start for slot in speaker.schedule] or [0])
+
+
+def addSlot(speaker, slot):
+    """Add (or move) the slot of a session in the speaker's schedule."""
+    if any(other.websafeKey == slot.websafeKey for other in speaker.schedule):
+        removeSlot(speaker, slot.websafeKey)
+    index = bisect_left(_SlotStarts(speaker.schedule), slot.start)
+    speaker.schedule.insert(index, slot)
+    speaker.scheduleMaxDuration = max(speaker.scheduleMaxDuration,
+                                      slot.end - slot.start)
+
+
+def build(speaker, sessions):
+    """Rebuild the speaker's schedule from its linked sessions."""
+    slots = [slotFor(a_session) for a_session in sessions if a_session]
+    speaker.schedule = sorted([slot for slot in slots if slot],
+        key=lambda slot: slot.start)
+    speaker.scheduleMaxDuration = max(
+        [slot.end - slot.start for slot in speaker.schedule] or [0])
+    speaker.scheduleBuilt = True
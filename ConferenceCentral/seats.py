@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+"""seats.py
+
+Udacity conference server-side Python App Engine sharded seat counters
+
+A conference's available seats are split over SeatShard root entities, so
+concurrent registrations write to different entity groups instead of all
+contending on the Conference. Each shard only hands out the seats it
+holds, which bounds allocation by maxAttendees. Conference.seatsAvailable
+is kept as a summary, reconciled from the shards by a task scheduled
+after registrations.
+
+"""
+
+import random
+import time
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import SeatShard
+
+NUM_SEAT_SHARDS = 10
+# seconds between reconciliations of Conference.seatsAvailable
+RECONCILE_INTERVAL = 10
+
+
+def shardKeys(conference_key, count):
+    """Return the keys of the conference's count seat shards."""
+    wsck = conference_key.urlsafe()
+    return [ndb.Key(SeatShard, '%s:%d' % (wsck, i)) for i in range(count)]
+
+
+def newShards(conference_key, seats, count=NUM_SEAT_SHARDS):
+    """Return count SeatShard entities sharing seats as evenly as possible."""
+    share, remainder = divmod(max(seats or 0, 0), count)
+    return [SeatShard(key=key, conference=conference_key,
+                      seatsAvailable=share + (1 if i < remainder else 0))
+            for i, key in enumerate(shardKeys(conference_key, count))]
+
+
+@ndb.transactional(xg=True)
+def ensureShards(conference_key):
+    """Split the seatsAvailable of a conference created before seat
+    sharding over new shards; return the conference.
+    """
+    conf = conference_key.get()
+    if conf and not conf.seatShards:
+        shards = newShards(conference_key, conf.seatsAvailable)
+        conf.seatShards = len(shards)
+        ndb.put_multi(shards + [conf])
+    return conf
+
+
+def candidateShards(conf, available=True):
+    """Return the keys of the conference's shards in random order; only
+    those with seats left (as of a non-transactional read) if available.
+    """
+    keys = shardKeys(conf.key, conf.seatShards)
+    if available:
+        keys = [shard.key for shard in ndb.get_multi(keys)
+                if shard and shard.seatsAvailable > 0]
+    random.shuffle(keys)
+    return keys
+
+
+@ndb.transactional(xg=True)
+def resize(conf, delta):
+    """Add delta seats (or remove -delta seats that are still available)
+    across the conference's shards; return the seats available after.
+    Joins the caller's transaction, which must be cross-group.
+    """
+    shards = [shard for shard in ndb.get_multi(shardKeys(conf.key, conf.seatShards))
+              if shard]
+    if delta > 0:
+        for i in range(delta):
+            shards[i % len(shards)].seatsAvailable += 1
+    else:
+        takeSeats(shards, -delta)
+    ndb.put_multi(shards)
+    return sum(shard.seatsAvailable for shard in shards)
+
+
+def takeSeats(shards, count):
+    """Take up to count seats from shards (already read in the caller's
+    transaction); return the number of seats taken.
+    """
+    taken = 0
+    for shard in shards:
+        share = min(shard.seatsAvailable, count - taken)
+        shard.seatsAvailable -= share
+        taken += share
+    return taken
+
+
+def countSeats(conf):
+    """Return the seats available across the conference's shards."""
+    return sum(shard.seatsAvailable
+               for shard in ndb.get_multi(shardKeys(conf.key, conf.seatShards))
+               if shard)
+
+
+def scheduleReconcile(conference_key):
+    """Schedule at most one reconciliation per conference per interval."""
+    bucket = int(time.time() / RECONCILE_INTERVAL)
+    try:
+        taskqueue.add(
+            name='reconcile-seats-%s-%d' % (conference_key.urlsafe(), bucket),
+            params={'websafeConferenceKey': conference_key.urlsafe()},
+            url='/tasks/reconcile_seats',
+            countdown=RECONCILE_INTERVAL
+        )
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
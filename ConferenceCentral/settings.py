@@ -16,3 +16,12 @@ WEB_CLIENT_ID = '53892705221-kt14nvq614fst9fn21qlo5hp1t2p33bs.apps.googleusercon
 ANDROID_CLIENT_ID = 'replace with Android client ID'
 IOS_CLIENT_ID = 'replace with iOS client ID'
 ANDROID_AUDIENCE = WEB_CLIENT_ID
+
+# tokeninfo endpoint resolving OAuth tokens to user ids; point it at a
+# local fake server to test getUserId(user, "oauth")
+TOKENINFO_URL = 'https://www.googleapis.com/oauth2/v1/tokeninfo'
+
+# verify ID tokens against Google's signing keys instead of calling
+# tokeninfo; access tokens are still resolved by tokeninfo
+VERIFY_ID_TOKENS_LOCALLY = True
+GOOGLE_CERTS_URL = 'https://www.googleapis.com/oauth2/v3/certs'
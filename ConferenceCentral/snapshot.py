@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+
+"""snapshot.py
+
+Udacity conference server-side Python App Engine per-conference session
+snapshot
+
+A conference's sessions are few and rarely written, so they are kept as a
+compact, column oriented snapshot in memcache and in an instance-local LRU
+cache. Session listing and querying run against the snapshot instead of
+issuing an ancestor query per call. Writers call refreshSnapshot() once
+their change is committed.
+
+"""
+
+import logging
+
+from array import array
+from bisect import bisect_left
+from datetime import date
+from datetime import time
+
+from google.appengine.api import memcache
+
+from models import Session
+
+import predicates
+from utils import LRUCache
+from utils import newGeneration
+
+MEMCACHE_SNAPSHOT_TPL = "SESSION_SNAPSHOT:%s"
+MEMCACHE_SNAPSHOT_VERSION_TPL = "SESSION_SNAPSHOT_VERSION:%s"
+LOCAL_SNAPSHOT_CAPACITY = 100
+# bumped when the SessionSnapshot layout changes, so that snapshots cached
+# by an older version are rebuilt
+SNAPSHOT_FORMAT = 2
+
+# stands for a missing value in the integer columns
+MISSING = -1
+
+_local = LRUCache(LOCAL_SNAPSHOT_CAPACITY)
+
+
+def _toMinutes(a_time):
+    return a_time.hour * 60 + a_time.minute
+
+
+def _fromMinutes(minutes):
+    return time(minutes // 60, minutes % 60)
+
+
+def absoluteMinutes(a_date, a_time):
+    """Return the minutes from the start of the calendar to a_time on a_date."""
+    return a_date.toordinal() * 24 * 60 + _toMinutes(a_time)
+
+
+def sessionInterval(a_session):
+    """Return the (start, end) absoluteMinutes of a Session, None if it has
+    no date or start time.
+    """
+    if not (a_session.date and a_session.startTime):
+        return None
+    start = absoluteMinutes(a_session.date, a_session.startTime)
+    return (start, start + max(a_session.duration or 0, 0))
+
+
+class SessionSnapshot(object):
+    """SessionSnapshot -- column oriented copy of a conference's sessions
+
+    Rows are ordered by session name. Dates are stored as ordinals and
+    times as minutes past midnight, with MISSING for absent values.
+
+    Sessions with a date and start time are also indexed as intervals:
+    their rows ordered by absolute start, with the longest duration bounding
+    how far before a window an overlapping session can start.
+    """
+
+    # filter values are converted once to the column representation
+    CONVERT = {
+        'date': date.toordinal,
+        'startTime': _toMinutes,
+        'endTime': _toMinutes,
+    }
+
+    def __init__(self, version, sessions):
+        self.version = version
+        sessions = sorted(sessions, key=lambda s: (s.name, s.key.id()))
+
+        self.websafeKeys = [s.key.urlsafe() for s in sessions]
+        self.names = [s.name for s in sessions]
+        self.highlights = [s.highlights for s in sessions]
+        self.types = [s.typeOfSession for s in sessions]
+        self.dates = array('l', [s.date.toordinal() if s.date else MISSING
+                                 for s in sessions])
+        self.starts = array('l', [_toMinutes(s.startTime) if s.startTime else MISSING
+                                  for s in sessions])
+        self.ends = array('l', [_toMinutes(s.endTime) if s.endTime else MISSING
+                                for s in sessions])
+        self.durations = array('l', [s.duration if s.duration is not None else MISSING
+                                     for s in sessions])
+        # (websafeKey, name) of each linked speaker
+        self.speakers = [tuple((l.websafeKey, l.name) for l in s.speakers)
+                         for s in sessions]
+
+        # rows of each session type, in name order
+        self.byType = {}
+        for row, a_type in enumerate(self.types):
+            self.byType.setdefault(a_type, array('l')).append(row)
+
+        # interval index; sessions without a duration take no time
+        intervals = list(
+            (absoluteMinutes(s.date, s.startTime), max(s.duration or 0, 0), row)
+            for row, s in enumerate(sessions) if s.date and s.startTime)
+        intervals.sort(key=lambda interval: (interval[0], interval[2]))
+        self.byStart = array('l', [row for _, _, row in intervals])
+        self.startKeys = array('l', [start for start, _, _ in intervals])
+        self.startDurations = array('l', [duration for _, duration, _ in intervals])
+        self.maxDuration = max(self.startDurations) if intervals else 0
+        self.format = SNAPSHOT_FORMAT
+
+    def __len__(self):
+        return len(self.names)
+
+    def value(self, row, field):
+        """Return the column value of field for row, None if missing."""
+        if field == 'typeOfSession':
+            return self.types[row]
+        value = self._column(field)[row]
+        return None if value == MISSING else value
+
+    def _column(self, field):
+        return {
+            'date': self.dates,
+            'startTime': self.starts,
+            'endTime': self.ends,
+            'duration': self.durations,
+        }[field]
+
+    def select(self, filters=()):
+        """Return the rows matching all filters (formatted and parsed as for
+        the datastore), in name order.
+        """
+        filters = list(filters)
+        candidates = xrange(len(self))
+        # an equality filter on the session type is answered by the index
+        for f in filters:
+            if f["field"] == 'typeOfSession' and f["operator"] == predicates.EQ:
+                candidates = self.byType.get(f["value"], ())
+                filters.remove(f)
+                break
+        if not filters:
+            return list(candidates)
+        predicate = predicates.compileFilters(filters,
+            getter=self.value, convert=self.CONVERT)
+        return [row for row in candidates if predicate(row)]
+
+    def overlapping(self, start, end):
+        """Return the rows of sessions overlapping the window [start, end),
+        in absoluteMinutes, ordered by start.
+        """
+        # only sessions starting less than maxDuration before the window
+        # can reach into it
+        lo = bisect_left(self.startKeys, start - self.maxDuration)
+        hi = bisect_left(self.startKeys, end)
+        rows = []
+        for i in xrange(lo, hi):
+            session_start = self.startKeys[i]
+            if session_start >= start or session_start + self.startDurations[i] > start:
+                rows.append(self.byStart[i])
+        return rows
+
+    def session(self, row):
+        """Return a dict of the Session field values for row."""
+        a_date, start, end, duration = (self.dates[row], self.starts[row],
+                                        self.ends[row], self.durations[row])
+        return {
+            'websafeKey': self.websafeKeys[row],
+            'name': self.names[row],
+            'highlights': self.highlights[row],
+            'typeOfSession': self.types[row],
+            'date': date.fromordinal(a_date) if a_date != MISSING else None,
+            'startTime': _fromMinutes(start) if start != MISSING else None,
+            'endTime': _fromMinutes(end) if end != MISSING else None,
+            'duration': duration if duration != MISSING else None,
+            'speakers': self.speakers[row],
+        }
+
+
+def _currentVersion(wsck):
+    key = MEMCACHE_SNAPSHOT_VERSION_TPL % wsck
+    version = memcache.get(key)
+    if version is None:
+        memcache.add(key, newGeneration())
+        version = memcache.get(key)
+    return version
+
+
+def _build(conference_key, version):
+    """Build the snapshot from a (strongly consistent) ancestor query."""
+    a_snapshot = SessionSnapshot(version,
+        Session.query(ancestor=conference_key).fetch())
+    wsck = conference_key.urlsafe()
+    try:
+        memcache.set(MEMCACHE_SNAPSHOT_TPL % wsck, a_snapshot)
+    except ValueError as e:
+        # too large for memcache; the local copy still helps
+        logging.warning('session snapshot %s not cached: %s', wsck, e)
+    _local.set(wsck, a_snapshot)
+    return a_snapshot
+
+
+def _current(a_snapshot, version):
+    return (a_snapshot is not None and a_snapshot.version == version and
+            getattr(a_snapshot, 'format', None) == SNAPSHOT_FORMAT)
+
+
+def getSnapshot(conference_key):
+    """Return the current SessionSnapshot of the conference."""
+    wsck = conference_key.urlsafe()
+    version = _currentVersion(wsck)
+
+    a_snapshot = _local.get(wsck)
+    if _current(a_snapshot, version):
+        return a_snapshot
+
+    a_snapshot = memcache.get(MEMCACHE_SNAPSHOT_TPL % wsck)
+    if _current(a_snapshot, version):
+        _local.set(wsck, a_snapshot)
+        return a_snapshot
+
+    return _build(conference_key, version)
+
+
+def refreshSnapshot(conference_key):
+    """Rebuild the conference snapshot after its sessions were written.
+
+    Bumping the version first makes snapshots built concurrently from
+    older data unusable.
+    """
+    wsck = conference_key.urlsafe()
+    version = memcache.incr(MEMCACHE_SNAPSHOT_VERSION_TPL % wsck,
+        initial_value=newGeneration())
+    if version is None:
+        # memcache unavailable; readers will rebuild
+        _local.delete(wsck)
+        return
+    _build(conference_key, version)
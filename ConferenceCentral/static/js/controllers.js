@@ -423,12 +423,29 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
         }
     };
 
+    /**
+     * Holds the token of the next page of queryConferences results, if any.
+     * @type {string}
+     */
+    $scope.nextPageToken = null;
+
+    // a page token only continues the query of the filters it came with
+    $scope.$watch('filters', function () {
+        $scope.nextPageToken = null;
+    }, true);
+
     /**
      * Invokes the conference.queryConferences API.
+     *
+     * @param {boolean} nextPage true to append the next page to the current results.
      */
-    $scope.queryConferencesAll = function () {
+    $scope.queryConferencesAll = function (nextPage) {
         var sendFilters = {
-            filters: []
+            filters: [],
+            pageSize: $scope.pagination.pageSize
+        }
+        if (nextPage && $scope.nextPageToken) {
+            sendFilters.pageToken = $scope.nextPageToken;
         }
         for (var i = 0; i < $scope.filters.length; i++) {
             var filter = $scope.filters[i];
@@ -458,10 +475,19 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         $scope.alertStatus = 'success';
                         $log.info($scope.messages);
 
-                        $scope.conferences = [];
+                        if (!nextPage) {
+                            $scope.conferences = [];
+                        }
                         angular.forEach(resp.items, function (conference) {
                             $scope.conferences.push(conference);
                         });
+                        $scope.nextPageToken = resp.nextPageToken || null;
+                        // a page may stop at the server's scan bound with no
+                        // matches; carry on to the next one
+                        if (!(resp.items && resp.items.length) && $scope.nextPageToken) {
+                            $scope.queryConferencesAll(true);
+                            return;
+                        }
                     }
                     $scope.submitted = true;
                 });
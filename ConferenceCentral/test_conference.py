@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+"""test_conference.py
+
+Udacity conference server-side Python App Engine API tests; run with the
+App Engine SDK on the path:
+
+    python -m unittest test_conference
+
+"""
+
+import time
+import unittest
+
+from google.appengine.api import memcache
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+import conference
+from conference import ConferenceApi
+from models import Conference
+from models import ConferenceQueryForms
+from models import Profile
+
+
+class QueryConferencesCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        # global queries see no write until it is applied, as right after
+        # a write in production
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+                probability=0))
+        self.testbed.init_memcache_stub()
+        ndb.get_context().clear_cache()
+        self.api = ConferenceApi()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def _createConference(self, name):
+        p_key = ndb.Key(Profile, 'organizer@example.com')
+        Conference(parent=p_key, name=name, organizerUserId=p_key.id(),
+                   maxAttendees=10, seatsAvailable=10).put()
+        ConferenceApi._bumpConferenceGeneration()
+
+    def _cachedPage(self):
+        return memcache.get(self.api._conferenceQueryCacheKey(
+            [], conference.DEFAULT_PAGE_SIZE, None))
+
+    def testStalePageAfterBumpIsNotCached(self):
+        self._createConference('Stale')
+
+        forms = self.api.queryConferences(ConferenceQueryForms())
+        # the query ran before the write was applied
+        self.assertEqual([], [form.name for form in forms.items])
+        self.assertIsNone(self._cachedPage())
+
+    def testPageIsCachedOnceSettled(self):
+        self._createConference('Settled')
+        memcache.set(conference.MEMCACHE_CONFERENCE_WRITTEN_KEY,
+            time.time() - conference.CONFERENCE_QUERY_SETTLE_TIME)
+
+        self.api.queryConferences(ConferenceQueryForms())
+        self.assertIsNotNone(self._cachedPage())
+
+
+if __name__ == '__main__':
+    unittest.main()
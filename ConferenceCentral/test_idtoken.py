@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+"""test_idtoken.py
+
+Udacity conference server-side Python App Engine ID token verification
+tests; run with the App Engine SDK and pycrypto on the path:
+
+    python -m unittest test_idtoken
+
+"""
+
+import base64
+import json
+import time
+import unittest
+
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import RSA
+from Crypto.Signature import PKCS1_v1_5
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+from google.appengine.ext import testbed
+
+import idtoken
+import utils
+from settings import WEB_CLIENT_ID
+from test_utils import FakeTokenInfo
+
+KID = 'test-key'
+# generated once, as it takes a while
+KEY = RSA.generate(2048)
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+
+def _fromLong(value):
+    digits = '%x' % value
+    return _b64encode(('0' * (len(digits) % 2) + digits).decode('hex'))
+
+
+def makeToken(key=KEY, **overrides):
+    """Return an ID token signed with key; overrides replace or, given as
+    None, remove header and claim fields.
+    """
+    now = int(time.time())
+    header = {'alg': 'RS256', 'kid': KID}
+    claims = {'iss': 'accounts.google.com', 'aud': WEB_CLIENT_ID,
+              'sub': '123', 'iat': now, 'exp': now + 3600}
+    for name, value in overrides.items():
+        fields = header if name in ('alg', 'kid') else claims
+        if value is None:
+            fields.pop(name, None)
+        else:
+            fields[name] = value
+    signed = '%s.%s' % (_b64encode(json.dumps(header)), _b64encode(json.dumps(claims)))
+    signature = PKCS1_v1_5.new(key).sign(SHA256.new(signed))
+    return '%s.%s' % (signed, _b64encode(signature))
+
+
+class VerifyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_memcache_stub()
+        self.tokeninfo = FakeTokenInfo()
+        apiproxy_stub_map.apiproxy.RegisterStub('urlfetch', self.tokeninfo)
+        memcache.set(idtoken.MEMCACHE_CERTS_KEY,
+            {KID: (_fromLong(KEY.n), _fromLong(KEY.e))})
+        idtoken._local = (None, {})
+        utils._tokens = utils.LRUCache(utils.LOCAL_TOKEN_CAPACITY)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def testValidToken(self):
+        claims = idtoken.verify(makeToken())
+        self.assertEqual('123', claims['sub'])
+        self.assertEqual([], self.tokeninfo.urls)
+
+    def testValidTokenResolvesUserId(self):
+        self.assertEqual('123', utils._tokenUserId(makeToken(), 'id_token'))
+        self.assertEqual([], self.tokeninfo.urls)
+
+    def testBadSignature(self):
+        other = RSA.generate(1024)
+        self.assertRaises(idtoken.InvalidToken,
+            idtoken.verify, makeToken(key=other))
+
+    def testTamperedClaims(self):
+        header, _, signature = makeToken().split('.')
+        claims = _b64encode(json.dumps({'iss': 'accounts.google.com',
+            'aud': WEB_CLIENT_ID, 'sub': '456', 'exp': time.time() + 3600}))
+        self.assertRaises(idtoken.InvalidToken,
+            idtoken.verify, '.'.join([header, claims, signature]))
+
+    def testWrongAudience(self):
+        self.assertRaises(idtoken.InvalidToken,
+            idtoken.verify, makeToken(aud='another-client'))
+
+    def testWrongIssuer(self):
+        self.assertRaises(idtoken.InvalidToken,
+            idtoken.verify, makeToken(iss='https://example.com'))
+
+    def testExpired(self):
+        expired = int(time.time()) - idtoken.CLOCK_SKEW - 60
+        self.assertRaises(idtoken.InvalidToken,
+            idtoken.verify, makeToken(exp=expired))
+
+    def testIssuedInTheFuture(self):
+        issued = int(time.time()) + idtoken.CLOCK_SKEW + 60
+        self.assertRaises(idtoken.InvalidToken,
+            idtoken.verify, makeToken(iat=issued))
+
+    def testNoSubject(self):
+        self.assertRaises(idtoken.InvalidToken,
+            idtoken.verify, makeToken(sub=None))
+
+    def testUnsupportedAlgorithm(self):
+        for alg in ('none', 'HS256', 'RS512'):
+            self.assertRaises(idtoken.InvalidToken,
+                idtoken.verify, makeToken(alg=alg))
+
+    def testRejectedTokenIsNotLookedUp(self):
+        self.assertEqual('', utils._tokenUserId(
+            makeToken(aud='another-client'), 'id_token'))
+        self.assertEqual([], self.tokeninfo.urls)
+
+    def testUnknownKeyFallsBackToTokenInfo(self):
+        token = makeToken(kid='rotated-key')
+        self.assertIsNone(idtoken.verify(token))
+        self.tokeninfo.responses.append(
+            (200, json.dumps({'user_id': '123', 'expires_in': 3600})))
+        self.assertEqual('123', utils._tokenUserId(token, 'id_token'))
+        self.assertEqual(1, len(self.tokeninfo.urls))
+        self.assertIn('id_token=', self.tokeninfo.urls[0])
+
+    def testNotAJwt(self):
+        self.assertIsNone(idtoken.verify('not-a-jwt'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+"""test_utils.py
+
+Udacity conference server-side Python App Engine utility tests; run with
+the App Engine SDK on the path:
+
+    python -m unittest test_utils
+
+"""
+
+import hashlib
+import json
+import time
+import unittest
+
+from google.appengine.api import apiproxy_stub
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+from google.appengine.ext import testbed
+
+import utils
+from utils import overlappingPairs
+
+
+class FakeTokenInfo(apiproxy_stub.APIProxyStub):
+    """FakeTokenInfo -- urlfetch stub answering with queued responses"""
+
+    def __init__(self):
+        super(FakeTokenInfo, self).__init__('urlfetch')
+        self.responses = [] # (status code, content) in order
+        self.urls = []
+
+    def _Dynamic_Fetch(self, request, response):
+        self.urls.append(request.url())
+        status, content = self.responses.pop(0)
+        response.set_statuscode(status)
+        response.set_content(content)
+
+
+class TokenUserIdTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_memcache_stub()
+        self.tokeninfo = FakeTokenInfo()
+        apiproxy_stub_map.apiproxy.RegisterStub('urlfetch', self.tokeninfo)
+        utils._tokens = utils.LRUCache(utils.LOCAL_TOKEN_CAPACITY)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def _answer(self, user_id, expires_in=3600):
+        self.tokeninfo.responses.append(
+            (200, json.dumps({'user_id': user_id, 'expires_in': expires_in})))
+
+    def _expire(self, token):
+        expired = (time.time() - 1, 'expired')
+        digest = hashlib.sha256(token).hexdigest()
+        utils._tokens.set(digest, expired)
+        memcache.set(utils.MEMCACHE_TOKEN_TPL % digest, expired)
+
+    def testLocalCacheHit(self):
+        self._answer('123')
+        self.assertEqual('123', utils._tokenUserId('token', 'access_token'))
+        self.assertEqual('123', utils._tokenUserId('token', 'access_token'))
+        self.assertEqual(1, len(self.tokeninfo.urls))
+
+    def testMemcacheHit(self):
+        self._answer('123')
+        utils._tokenUserId('token', 'access_token')
+        # another instance, sharing memcache only
+        utils._tokens = utils.LRUCache(utils.LOCAL_TOKEN_CAPACITY)
+        self.assertEqual('123', utils._tokenUserId('token', 'access_token'))
+        self.assertEqual(1, len(self.tokeninfo.urls))
+
+    def testExpiredTokenIsLookedUpAgain(self):
+        self._answer('123')
+        utils._tokenUserId('token', 'access_token')
+        self._expire('token')
+        self._answer('456')
+        self.assertEqual('456', utils._tokenUserId('token', 'access_token'))
+        self.assertEqual(2, len(self.tokeninfo.urls))
+
+    def testNoExpiryIsNotCached(self):
+        self._answer('123', expires_in=0)
+        utils._tokenUserId('token', 'access_token')
+        self._answer('123', expires_in=0)
+        utils._tokenUserId('token', 'access_token')
+        self.assertEqual(2, len(self.tokeninfo.urls))
+
+    def testServerErrorIsRetried(self):
+        self.tokeninfo.responses.append((503, ''))
+        self._answer('123')
+        self.assertEqual('123', utils._tokenUserId('token', 'access_token'))
+        self.assertEqual(2, len(self.tokeninfo.urls))
+
+    def testRetriesAreBounded(self):
+        self.tokeninfo.responses.extend(
+            [(500, '')] * utils.TOKENINFO_ATTEMPTS)
+        self.assertEqual('', utils._tokenUserId('token', 'access_token'))
+        self.assertEqual(utils.TOKENINFO_ATTEMPTS, len(self.tokeninfo.urls))
+
+    def testInvalidTokenIsNotRetried(self):
+        self.tokeninfo.responses.append((400, '{"error": "invalid_token"}'))
+        self.assertEqual('', utils._tokenUserId('token', 'access_token'))
+        self.assertEqual(1, len(self.tokeninfo.urls))
+
+    def testRejectedIdTokenIsLookedUpAsAccessToken(self):
+        self.tokeninfo.responses.append((400, '{"error": "invalid_token"}'))
+        self._answer('123')
+        self.assertEqual('123', utils._fetchTokenInfo('token', 'id_token')['user_id'])
+        self.assertIn('access_token=token', self.tokeninfo.urls[1])
+
+
+class OverlappingPairsTest(unittest.TestCase):
+
+    def _pairs(self, intervals):
+        return sorted(tuple(sorted(pair)) for pair in overlappingPairs(intervals))
+
+    def testOverlappingIntervals(self):
+        self.assertEqual([('a', 'b'), ('a', 'c'), ('b', 'c')],
+            self._pairs([(0, 60, 'a'), (30, 90, 'b'), (45, 50, 'c')]))
+
+    def testAdjacentIntervalsDoNotOverlap(self):
+        self.assertEqual([], self._pairs([(0, 60, 'a'), (60, 120, 'b')]))
+
+    def testNestedInterval(self):
+        self.assertEqual([('a', 'b')],
+            self._pairs([(10, 20, 'b'), (0, 60, 'a')]))
+
+    def testEqualIntervals(self):
+        self.assertEqual([('a', 'b')], self._pairs([(0, 60, 'a'), (0, 60, 'b')]))
+
+    def testEmptyIntervalsOverlapNothing(self):
+        # wherever they fall, before, at the start of or inside another
+        self.assertEqual([], self._pairs([
+            (0, 60, 'a'), (0, 0, 'b'), (30, 30, 'c'), (60, 60, 'd'),
+            (30, 20, 'e')]))
+
+    def testManyIntervals(self):
+        intervals = [(i, i + 3, i) for i in range(100)]
+        expected = sorted((i, j) for i in range(100) for j in range(i + 1, i + 3)
+                          if j < 100)
+        self.assertEqual(expected, self._pairs(intervals))
+
+
+if __name__ == '__main__':
+    unittest.main()
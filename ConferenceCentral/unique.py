@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+"""unique.py
+
+Udacity conference server-side Python App Engine uniqueness markers
+
+A name that must be unique among entities of a kind (session names,
+session type labels) is claimed by a UniqueValue entity keyed by the kind
+and the normalized name. Claiming and releasing run in the transaction
+writing the entity, so the duplicate check is a strongly consistent key
+lookup rather than a global query.
+
+"""
+
+from google.appengine.ext import ndb
+
+from models import UniqueValue
+from models import normalizeName
+
+normalize = normalizeName
+
+
+def markerKey(kind, value):
+    """Return the key of the marker for value among entities of kind."""
+    return ndb.Key(UniqueValue, u'%s:%s' % (kind, normalize(value)))
+
+
+def claim(kind, value, target_key):
+    """Claim value for target_key, in the caller's transaction; return
+    False if another entity holds it.
+    """
+    key = markerKey(kind, value)
+    marker = key.get()
+    if marker:
+        return marker.target == target_key
+    UniqueValue(key=key, target=target_key).put()
+    return True
+
+
+def release(kind, value, target_key):
+    """Release value if target_key holds it, in the caller's transaction."""
+    key = markerKey(kind, value)
+    marker = key.get()
+    if marker and marker.target == target_key:
+        key.delete()
@@ -1,10 +1,28 @@
+import hashlib
+import heapq
 import json
+import logging
 import os
+import threading
 import time
 import uuid
 
+from collections import OrderedDict
+
+from google.appengine.api import memcache
 from google.appengine.api import urlfetch
 from models import Profile
+from settings import TOKENINFO_URL
+from settings import VERIFY_ID_TOKENS_LOCALLY
+
+import idtoken
+
+MEMCACHE_TOKEN_TPL = "OAUTH_TOKEN:%s"
+LOCAL_TOKEN_CAPACITY = 1000
+# seconds a resolved token is cached when tokeninfo gives no expiry
+TOKEN_CACHE_TIME = 300
+TOKENINFO_ATTEMPTS = 3
+TOKENINFO_DEADLINE = 5 # seconds
 
 def getUserId(user, id_type="email"):
     if id_type == "email":
@@ -15,24 +33,10 @@ def getUserId(user, id_type="email"):
         auth = os.getenv('HTTP_AUTHORIZATION')
         bearer, token = auth.split()
         token_type = 'id_token'
-        if 'OAUTH_USER_ID' in os.environ:
+        # an ID token is a JWT, three dot separated segments
+        if 'OAUTH_USER_ID' in os.environ or token.count('.') != 2:
             token_type = 'access_token'
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-               % (token_type, token))
-        user = {}
-        wait = 1
-        for i in range(3):
-            resp = urlfetch.fetch(url)
-            if resp.status_code == 200:
-                user = json.loads(resp.content)
-                break
-            elif resp.status_code == 400 and 'invalid_token' in resp.content:
-                url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                       % ('access_token', token))
-            else:
-                time.sleep(wait)
-                wait = wait + i
-        return user.get('user_id', '')
+        return _tokenUserId(token, token_type)
 
     if id_type == "custom":
         # implement your own user_id creation and getting algorythm
@@ -43,3 +47,132 @@ def getUserId(user, id_type="email"):
             return profile.id()
         else:
             return str(uuid.uuid1().get_hex())
+
+
+def newGeneration():
+    """Return a seed for a memcache generation counter that was evicted;
+    derived from the clock so it doesn't reuse generations of entries
+    still cached.
+    """
+    return int(time.time() * 1000) * 1000
+
+
+class LRUCache(object):
+    """LRUCache -- small thread-safe instance-local cache"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                return default
+            self._items[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+
+_tokens = LRUCache(LOCAL_TOKEN_CAPACITY)
+
+
+def _tokenUserId(token, token_type):
+    """Return the user id of an OAuth token, '' if it can't be resolved;
+    cached by token hash until the token expires.
+    """
+    digest = hashlib.sha256(token).hexdigest()
+    now = time.time()
+    cached = _tokens.get(digest)
+    if cached and cached[0] > now:
+        return cached[1]
+    cached = memcache.get(MEMCACHE_TOKEN_TPL % digest)
+    if cached and cached[0] > now:
+        _tokens.set(digest, cached)
+        return cached[1]
+
+    info = None
+    if token_type == 'id_token' and VERIFY_ID_TOKENS_LOCALLY:
+        info = _verifyIdToken(token, now)
+    if info is None:
+        info = _fetchTokenInfo(token, token_type)
+    user_id = info.get('user_id', '')
+    try:
+        ttl = int(info.get('expires_in', TOKEN_CACHE_TIME))
+    except (TypeError, ValueError):
+        ttl = TOKEN_CACHE_TIME
+    if user_id and ttl > 0:
+        cached = (now + ttl, user_id)
+        memcache.set(MEMCACHE_TOKEN_TPL % digest, cached, time=ttl)
+        _tokens.set(digest, cached)
+    return user_id
+
+
+def _verifyIdToken(token, now):
+    """Return the tokeninfo of an ID token verified locally, {} if it is
+    invalid, None if it must be resolved by tokeninfo.
+    """
+    try:
+        claims = idtoken.verify(token)
+    except idtoken.InvalidToken as e:
+        logging.info('utils: ID token rejected: %s', e)
+        return {}
+    if claims is None:
+        return None
+    return {'user_id': claims['sub'],
+            'expires_in': int(float(claims['exp']) - now)}
+
+
+def _fetchTokenInfo(token, token_type):
+    """Return the tokeninfo of token, {} if it can't be resolved.
+
+    An id_token rejected by tokeninfo is looked up again as an access
+    token. Lookups failing on errors or timeouts are retried right away.
+    """
+    for attempt in range(TOKENINFO_ATTEMPTS):
+        url = '%s?%s=%s' % (TOKENINFO_URL, token_type, token)
+        rpc = urlfetch.create_rpc(deadline=TOKENINFO_DEADLINE)
+        urlfetch.make_fetch_call(rpc, url)
+        try:
+            resp = rpc.get_result()
+        except urlfetch.Error:
+            continue
+        if resp.status_code == 200:
+            return json.loads(resp.content)
+        if (resp.status_code == 400 and 'invalid_token' in resp.content and
+                token_type != 'access_token'):
+            token_type = 'access_token'
+        elif resp.status_code < 500:
+            break
+    return {}
+
+
+def overlappingPairs(intervals):
+    """Return the pairs of items whose intervals overlap, given
+    (start, end, item) tuples; a sweep in start order over the intervals
+    still open, O(n log n + pairs). Intervals are half-open, so empty ones
+    overlap nothing.
+    """
+    pairs = []
+    active = [] # heap of (end, index, item) of intervals still open
+    for index, (start, end, item) in enumerate(sorted(
+            (interval for interval in intervals if interval[1] > interval[0]),
+            key=lambda interval: interval[:2])):
+        while active and active[0][0] <= start:
+            heapq.heappop(active)
+        for _, _, other in active:
+            pairs.append((other, item))
+        heapq.heappush(active, (end, index, item))
+    return pairs